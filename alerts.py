@@ -0,0 +1,174 @@
+import re
+import threading
+
+import database
+from matcher import KeywordMatcher, tokenize
+from urls import link_key
+
+# --- CONFIGURATION ---
+# Rules are AND-ed clauses, e.g.  firm=BCG AND topic=AI & Tech AND impact>=70
+#   firm= / region= / topic=   exact attribute match (case-insensitive)
+#   impact>=N (also >, <=, <, =)
+#   "supply chain" or keyword=net zero   whole-word phrase in the headline or summary
+ATTRIBUTES = {"firm": "firm", "region": "region", "topic": "topic"}
+# A rule is indexed under one clause only, the one likely to match fewest articles
+ANCHOR_ORDER = ["keyword", "firm", "topic", "region"]
+IMPACT_OPS = {
+    ">=": lambda a, b: a >= b, ">": lambda a, b: a > b,
+    "<=": lambda a, b: a <= b, "<": lambda a, b: a < b, "=": lambda a, b: a == b,
+}
+
+# Upper-case AND only, and not inside quotes: "mergers and acquisitions" is one phrase
+CLAUSE_SPLIT_RE = re.compile(r'\s+AND\s+(?=(?:[^"]*"[^"]*")*[^"]*$)')
+ATTRIBUTE_RE = re.compile(r"^(firm|region|topic)\s*=\s*(.+)$", re.IGNORECASE)
+IMPACT_RE = re.compile(r"^impact\s*(>=|<=|>|<|=)\s*(\d+)$", re.IGNORECASE)
+MALFORMED_RE = re.compile(r"^(firm|region|topic|impact)\s*[<>=!]", re.IGNORECASE)
+KEYWORD_RE = re.compile(r"^(?:keyword|text)\s*[=:]\s*(.+)$", re.IGNORECASE)
+
+
+def _unquote(value):
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        value = value[1:-1].strip()
+    return value
+
+
+def parse_rule(query):
+    """
+    Parses a rule into {'equals': {attribute: lowercased value}, 'impact': [(op, n)],
+    'keywords': [normalized phrase]}. Raises ValueError on a clause it can't read.
+    """
+    rule = {"equals": {}, "impact": [], "keywords": []}
+    for clause in CLAUSE_SPLIT_RE.split(query.strip()):
+        clause = clause.strip()
+        if not clause:
+            raise ValueError("Empty clause")
+        attribute, impact, keyword = ATTRIBUTE_RE.match(clause), IMPACT_RE.match(clause), KEYWORD_RE.match(clause)
+        if attribute:
+            name, value = attribute.group(1).lower(), _unquote(attribute.group(2)).lower()
+            if name in rule["equals"] and rule["equals"][name] != value:
+                raise ValueError(f"Conflicting values for {name}")
+            rule["equals"][name] = value
+        elif impact:
+            rule["impact"].append((impact.group(1), int(impact.group(2))))
+        elif MALFORMED_RE.match(clause):
+            raise ValueError(f"Can't read clause: {clause}")
+        else:
+            phrase = " ".join(tokenize(_unquote(keyword.group(1) if keyword else clause)))
+            if not phrase:
+                raise ValueError(f"Can't read clause: {clause}")
+            rule["keywords"].append(phrase)
+    return rule
+
+
+class AlertIndex:
+    """
+    Inverted index from rule terms and attribute values to rules.
+    Each rule is filed under one anchor clause (a keyword, else firm, topic or region)
+    and only rules whose anchor an article has are evaluated in full, so the cost per
+    article depends on the rules it could match, not on how many rules exist. Keywords
+    of all rules share one KeywordMatcher, a single pass over the article's words.
+    Rules with nothing to anchor on (impact-only) are checked against every article.
+    """
+
+    def __init__(self, rules=()):
+        self.by_anchor = {}    # (clause kind, value) -> [(rule_id, parsed rule)]
+        self.unanchored = []
+        self.matcher = KeywordMatcher()
+        self.size = 0
+        for rule_id, query in rules:
+            self.add(rule_id, query)
+
+    def add(self, rule_id, query):
+        rule = parse_rule(query)
+        for phrase in rule["keywords"]:
+            self.matcher.add("keyword", phrase, phrase)
+        if rule["keywords"]:
+            # Longer phrases are rarer
+            anchor = ("keyword", max(rule["keywords"], key=len))
+        else:
+            kinds = [kind for kind in ANCHOR_ORDER if kind in rule["equals"]]
+            anchor = (kinds[0], rule["equals"][kinds[0]]) if kinds else None
+        if anchor is None:
+            self.unanchored.append((rule_id, rule))
+        else:
+            self.by_anchor.setdefault(anchor, []).append((rule_id, rule))
+        self.size += 1
+
+    def match(self, article):
+        """Ids of the rules an article (a dict with the articles column names) satisfies."""
+        values = {kind: str(article.get(column) or "").lower() for kind, column in ATTRIBUTES.items()}
+        if not values["topic"]:
+            values["topic"] = "others"  # as the Dashboard shows untagged articles
+        keywords = set()
+        if self.matcher.size:
+            text = f"{article.get('title') or ''} {article.get('summary') or ''}"
+            keywords = self.matcher.match(text).get("keyword", set())
+
+        candidates = list(self.unanchored)
+        for kind, value in values.items():
+            candidates.extend(self.by_anchor.get((kind, value), ()))
+        for phrase in keywords:
+            candidates.extend(self.by_anchor.get(("keyword", phrase), ()))
+
+        impact = article.get("impact_score")
+        matched = []
+        for rule_id, rule in candidates:
+            if any(values[kind] != value for kind, value in rule["equals"].items()):
+                continue
+            if rule["impact"] and (impact is None or not all(IMPACT_OPS[op](impact, n) for op, n in rule["impact"])):
+                continue
+            if any(phrase not in keywords for phrase in rule["keywords"]):
+                continue
+            matched.append(rule_id)
+        return matched
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def current_index():
+    """The index of the active rules, rebuilt only when a rule has been added, changed or removed."""
+    global _index, _index_version
+    version = database.get_data_version("alert_rules")
+    with _index_lock:
+        if _index is None or _index_version != version:
+            rules = database.get_alert_rules(active_only=True)
+            index = AlertIndex()
+            for rule_id, query in zip(rules["id"], rules["query"]):
+                try:
+                    index.add(int(rule_id), query)
+                except ValueError as e:
+                    print(f"Skipping alert rule {rule_id}: {e}")
+            _index, _index_version = index, version
+        return _index
+
+
+def add_rule(name, query):
+    """Validates and stores a rule. Raises ValueError if the query can't be parsed."""
+    parse_rule(query)
+    return database.add_alert_rule(name.strip() or query.strip(), query.strip())
+
+
+def check_articles(articles, new_keys=None):
+    """
+    Evaluates freshly stored articles (dicts with the articles column names) against the
+    active rules and stores the hits. With `new_keys` (upsert_articles()' link keys of
+    inserted rows) only those are checked. Returns the number of new alerts.
+    """
+    index = current_index()
+    if not index.size:
+        return 0
+    hits = []
+    for a in articles:
+        if not a.get("url"):
+            continue
+        key = link_key(a["url"])
+        if new_keys is not None and key not in new_keys:
+            continue
+        for rule_id in index.match(a):
+            hits.append((rule_id, key, a["url"], a.get("title"), a.get("firm"), a.get("topic"),
+                         a.get("impact_score"), str(a.get("published_date") or "") or None))
+    return database.save_alerts(hits) if hits else 0
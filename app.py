@@ -1,23 +1,32 @@
 import streamlit as st
 import pandas as pd
 import datetime
-from engine import fetch_and_rank
-from database import init_db, save_article, get_saved_articles, remove_saved_article, add_source, get_sources
-
-# --- INITIALIZE DATABASE ---
-init_db()
+import html
+import re
+from urls import link_key
+from database import init_db, save_article, get_saved_keys_among, remove_saved_article, add_source, get_sources, query_articles, query_saved, get_filter_options, search_articles, search_saved, get_source_health, get_stage_metrics, get_alert_rules, set_alert_rule_active, delete_alert_rule, get_alerts, count_unseen_alerts, mark_alerts_seen, get_open_breakers
+from alerts import add_rule
+# engine (feedparser, requests, the fetch pool), metrics and exports are imported where they're used:
+# every click reruns this script, and most reruns never sync
 
 # --- UI CONFIGURATION ---
 st.set_page_config(page_title="Strategic Knowledge Dashboard", layout="wide", initial_sidebar_state="collapsed")
 
+# --- INITIALIZE DATABASE ---
+# Once per server process rather than on every rerun
+@st.cache_resource
+def init_app():
+    init_db()
+    return True
+
+init_app()
+
 # --- SESSION STATE ---
 if "current_page" not in st.session_state:
     st.session_state.current_page = "Dashboard"
-if "saved_links" not in st.session_state:
-    st.session_state.saved_links = set(get_saved_articles()["link"].tolist())
 
 # --- CUSTOM CSS (Terminal Elite v4.1 - Refined) ---
-st.markdown("""
+CSS = """
 <style>
     @import url('https://fonts.googleapis.com/css2?family=Outfit:wght@300;400;500;600;700&display=swap');
     @import url('https://cdn.jsdelivr.net/npm/lucide-static@0.321.0/font/lucide.min.css');
@@ -179,7 +188,15 @@ st.markdown("""
     .nav-btn i { font-size: 1.2rem; }
 
 </style>
-""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource
+def compact_css():
+    # Minified once per process: the block is resent on every rerun
+    css = re.sub(r"\s+", " ", CSS)
+    return re.sub(r"\s*([{};:,>])\s*", r"\1", css).strip()
+
+st.markdown(compact_css(), unsafe_allow_html=True)
 
 # --- NAVIGATION INJECTOR ---
 # Since Streamlit buttons triggers reruns, we use them inside the bottom nav mockup
@@ -188,14 +205,50 @@ def set_page(page_name):
     st.rerun()
 
 # --- DATA FETCHING ---
-@st.cache_data(ttl=14400)
-def get_data():
+# Page loads only query the local store; feeds are pulled in by sync_feeds() or rss_aggregator.py
+DASHBOARD_LIMIT = 500
+SAVED_LIMIT = 200
+PAGE_SIZES = [25, 50, 100]
+DEFAULT_PAGE_SIZE = 50
+
+@st.cache_data(ttl=300)
+def get_page(region=None, topic=None, after=None, size=DEFAULT_PAGE_SIZE, archive=False):
+    # One keyset page: deep pages cost the same as the first. The archive is read only when asked for
+    try:
+        if archive:
+            from retention import query_all_articles
+            return query_all_articles(region=region, topic=topic, after=after, limit=size)
+        return query_articles(region=region, topic=topic, after=after, limit=size)
+    except:
+        return pd.DataFrame(), None
+
+@st.cache_data(ttl=300)
+def get_search_results(text, region=None, topic=None, archive=False):
     try:
-        sources_df = pd.read_csv("sources.csv")
-        return fetch_and_rank(sources_df)
+        if archive:
+            from retention import search_all_articles
+            return search_all_articles(text, region=region, topic=topic, limit=DASHBOARD_LIMIT)
+        return search_articles(text, region=region, topic=topic, limit=DASHBOARD_LIMIT)
     except:
         return pd.DataFrame()
 
+@st.cache_data(ttl=300)
+def get_filters():
+    try:
+        return get_filter_options()
+    except:
+        return [], []
+
+def sync_feeds():
+    from engine import ingest
+    sources_df = pd.read_csv("sources.csv")
+    with st.spinner("Syncing feeds..."):
+        added = ingest(sources_df)
+    get_page.clear()
+    get_search_results.clear()
+    get_filters.clear()
+    st.toast(f"{added} new items ingested.")
+
 # --- COMPONENTS ---
 
 def render_header(title):
@@ -219,112 +272,193 @@ def render_bottom_nav():
     pages = ["Dashboard", "Sources", "Saved", "Alerts", "Settings"]
     icons = ["layout-grid", "globe", "bookmark", "bell", "settings"]
     
+    unread = count_unseen_alerts()
+    
     # We use a trick: absolute positioned buttons under the visual footer
     st.markdown('<div class="bottom-nav">', unsafe_allow_html=True)
     for i, page in enumerate(pages):
         with cols[i]:
             is_active = st.session_state.current_page == page
             color = "var(--terminal-accent)" if is_active else "var(--terminal-muted)"
-            if st.button(f"{page}", key=f"nav_{page}", use_container_width=True):
+            label = f"{page} ({unread})" if page == "Alerts" and unread else page
+            if st.button(label, key=f"nav_{page}", use_container_width=True):
                 set_page(page)
     st.markdown('</div>', unsafe_allow_html=True)
 
+# --- DASHBOARD TABLE ---
+# Only the visible page is rendered: one HTML block for the rows plus a single
+# selectbox for star toggles, instead of a button widget per row.
+
+def reset_dashboard_page():
+    st.session_state.dash_cursors = [None]
+    st.session_state.dash_page = 0
+
+def turn_page(step, next_cursor=None):
+    if step > 0 and next_cursor is not None:
+        del st.session_state.dash_cursors[st.session_state.dash_page + 1:]
+        st.session_state.dash_cursors.append(next_cursor)
+    st.session_state.dash_page = max(0, st.session_state.dash_page + step)
+
+def toggle_saved(page_df):
+    idx = st.session_state.dash_toggle
+    if idx is None:
+        return
+    row = page_df.loc[idx]
+    if get_saved_keys_among([link_key(row['Link'])]):
+        remove_saved_article(row['Link'])
+    else:
+        save_article(row)
+    st.session_state.dash_toggle = None
+
+# --- EXPORT ---
+# Files are only built when asked for, streamed from the database with the current
+# filters over the full history, and reused until the articles change (see exports.py).
+
+def toggle_export():
+    st.session_state.export_open = not st.session_state.get("export_open", False)
+
+def render_export_panel(region, topic, text):
+    import exports
+    col_fmt, col_comp, col_build, col_dl = st.columns([1, 1, 1, 1])
+    with col_fmt:
+        fmt = st.selectbox("Format", exports.available_formats(), key="export_format",
+                           format_func=str.upper, label_visibility="collapsed")
+    with col_comp:
+        compression = st.selectbox("Compression", exports.available_compressions(fmt), key=f"export_compression_{fmt}",
+                                   format_func=lambda c: "Uncompressed" if c == "none" else c, label_visibility="collapsed")
+    request = (fmt, compression, region, topic, text or None)
+    path = None
+    with col_build:
+        if st.button("Build export", use_container_width=True):
+            with st.spinner("Building export..."):
+                path = exports.build_export(*request)
+    with col_dl:
+        # Offered only on the rerun of the Build click: download_button copies the whole file
+        # into Streamlit's media store, which must not happen on every rerun while the panel is open.
+        # Building again is cheap while the data is unchanged (build_export() reuses the file).
+        if path:
+            with open(path, "rb") as f:
+                st.download_button("📥 Download", f, use_container_width=True,
+                                   file_name=f"intelligence_export_{datetime.date.today()}{exports.file_suffix(fmt, compression)}",
+                                   mime=exports.mime_type(fmt, compression))
+
+def render_table_rows(page_df, saved_keys):
+    parts = []
+    for row in page_df.to_dict("records"):
+        link = html.escape(row['Link'] or "", quote=True)
+        is_new = row['Impact'] > 82
+        star = "⭐" if link_key(row['Link']) in saved_keys else "☆"
+        parts.append(f"""<tr class="tr-row" style="height: 38px;">
+            <td style="width: 4%; text-align: center;">{star}</td>
+            <td style="width: 12%;">{html.escape(str(row['Firm']))}</td>
+            <td style="width: 10%; color: var(--terminal-muted);">{html.escape(str(row['Region']))}</td>
+            <td style="width: 14%;">{html.escape(str(row['Topic']))}</td>
+            <td style="width: 50%; white-space: normal;">
+                <a href="{link}" target="_blank" style="text-decoration: none; color: inherit; font-weight: 500;">{html.escape(str(row['Headline']))}</a>
+            </td>
+            <td style="width: 10%;">
+                <span class="status-dot {'status-new' if is_new else 'status-active'}"></span>
+                <span style="font-weight: 500;">{'New' if is_new else 'Active'}</span>
+            </td>
+        </tr>""")
+    return "".join(parts)
+
 # --- PAGE: DASHBOARD ---
 if st.session_state.current_page == "Dashboard":
     render_header("Intelligence Repository")
-    df = get_data()
+    regions, topics = get_filters()
+    if "dash_cursors" not in st.session_state:
+        reset_dashboard_page()
     
     # Filters Row (Ultra-Surgical Spacing)
+    # Keyed widgets keep their values across page turns; changing any of them goes back to page 1
     st.markdown('<div class="filter-section">', unsafe_allow_html=True)
-    col1, col2, col3, col_exp = st.columns([1, 1, 2, 1])
+    col1, col2, col3, col_sync, col_exp = st.columns([1, 1, 1, 1, 1])
     
     with col1:
         st.markdown("<small style='color: var(--terminal-muted); font-size: 10px; margin-bottom: -5px;'>COUNTRY</small>", unsafe_allow_html=True)
-        region = st.selectbox("Country", ["All"] + sorted(df["Region"].unique().tolist()) if not df.empty else ["All"], label_visibility="collapsed")
+        region = st.selectbox("Country", ["All"] + regions, key="dash_region", on_change=reset_dashboard_page, label_visibility="collapsed")
     with col2:
         st.markdown("<small style='color: var(--terminal-muted); font-size: 10px; margin-bottom: -5px;'>AREA</small>", unsafe_allow_html=True)
-        topic = st.selectbox("Area", ["All"] + sorted(df["Topic"].unique().tolist()) if not df.empty else ["All"], label_visibility="collapsed")
+        topic = st.selectbox("Area", ["All"] + topics, key="dash_topic", on_change=reset_dashboard_page, label_visibility="collapsed")
+    with col3:
+        st.markdown("<small style='color: var(--terminal-muted); font-size: 10px; margin-bottom: -5px;'>SEARCH</small>", unsafe_allow_html=True)
+        query = st.text_input("Search", placeholder='e.g. decarbon* "supply chain"', key="dash_query", on_change=reset_dashboard_page, label_visibility="collapsed")
+    region_filter = None if region == "All" else region
+    topic_filter = None if topic == "All" else topic
+    page_size = st.session_state.get("dash_page_size", DEFAULT_PAGE_SIZE)
+    page = st.session_state.dash_page
+    # Articles past their retention tier live in monthly archive files (see retention.py)
+    archive = st.session_state.get("dash_archive", False)
+    if query.strip():
+        # Search results are ranked, not keyset-ordered, so they are paged in memory
+        results = get_search_results(query.strip(), region_filter, topic_filter, archive)
+        page_df = results.iloc[page * page_size:(page + 1) * page_size]
+        next_cursor = True if len(results) > (page + 1) * page_size else None
+    else:
+        page_df, next_cursor = get_page(region_filter, topic_filter, st.session_state.dash_cursors[page], page_size, archive)
+    with col_sync:
+        st.markdown("<div style='height: 12px;'></div>", unsafe_allow_html=True)
+        if st.button("⟳ Sync Feeds", use_container_width=True):
+            sync_feeds()
+            reset_dashboard_page()
+            st.rerun()
     with col_exp:
         st.markdown("<div style='height: 12px;'></div>", unsafe_allow_html=True)
-        csv_data = df.to_csv(index=False).encode('utf-8')
-        st.download_button(
-            label="📥 Quick Export",
-            data=csv_data,
-            file_name=f"intelligence_export_{datetime.date.today()}.csv",
-            mime="text/csv",
-            use_container_width=True
-        )
+        st.button("📥 Quick Export", on_click=toggle_export, use_container_width=True)
+    st.checkbox("Include archive", key="dash_archive", on_change=reset_dashboard_page,
+                help="Also show articles moved to the archive by retention (search matches archived headlines only)")
     st.markdown('</div>', unsafe_allow_html=True)
+    if st.session_state.get("export_open"):
+        render_export_panel(region_filter, topic_filter, query.strip())
 
-    if not df.empty:
-        f_df = df.copy()
-        if region != "All": f_df = f_df[f_df["Region"] == region]
-        if topic != "All": f_df = f_df[f_df["Topic"] == topic]
-        
-        # MONOLITHIC TABLE ENGINE (Surgical Alignment & Interactive Buttons)
-        st.markdown('<div class="terminal-container">', unsafe_allow_html=True)
-        
-        # We use a 2-column layout to keep stars functional while maintaining monolithic alignment for the rest
-        col_buttons, col_table_content = st.columns([0.04, 0.96])
-        
-        with col_buttons:
-            st.markdown("<div style='height: 35px;'></div>", unsafe_allow_html=True) # Header offset
-            for i, row in f_df.iterrows():
-                is_saved = row['Link'] in st.session_state.saved_links
-                icon = "⭐" if is_saved else "☆"
-                if st.button(icon, key=f"dash_save_{i}", help="Toggle Save"):
-                    if is_saved:
-                        remove_saved_article(row['Link'])
-                        st.session_state.saved_links.remove(row['Link'])
-                    else:
-                        save_article(row)
-                        st.session_state.saved_links.add(row['Link'])
-                    st.rerun()
-
-        with col_table_content:
-            table_header = """<table class="terminal-table" style="table-layout: fixed; width: 100%;">
-                <thead><tr>
-                    <th style="width: 12%;">Firm</th>
-                    <th style="width: 10%;">Country</th>
-                    <th style="width: 15%;">Area</th>
-                    <th style="width: 53%;">Publication</th>
-                    <th style="width: 10%;">Status</th>
-                </tr></thead><tbody>"""
-            
-            rows_html = ""
-            for idx, row in f_df.iterrows():
-                link = row['Link']
-                status_dot = "status-new" if row['Impact'] > 82 else "status-active"
-                status_txt = "New" if row['Impact'] > 82 else "Active"
-                
-                # Height must match Streamlit button height (approx 38px with tight padding)
-                rows_html += f"""<tr class="tr-row" style="height: 38px;">
-                    <td style="width: 12%;">{row['Firm']}</td>
-                    <td style="width: 10%; color: var(--terminal-muted);">{row['Region']}</td>
-                    <td style="width: 15%;">{row['Topic']}</td>
-                    <td style="width: 53%; white-space: normal;">
-                        <a href="{link}" target="_blank" style="text-decoration: none; color: inherit; font-weight: 500;">
-                            {row['Headline']}
-                        </a>
-                    </td>
-                    <td style="width: 10%;">
-                        <span class="status-dot {status_dot}"></span>
-                        <span style="font-weight: 500;">{status_txt}</span>
-                    </td>
-                </tr>"""
-            
-            table_footer = "</tbody></table></div>"
-            full_table = (table_header + rows_html + table_footer).strip()
-            st.markdown(full_table, unsafe_allow_html=True)
+    if not page_df.empty:
+        # MONOLITHIC TABLE ENGINE (one markdown call for the whole visible page)
+        table_header = """<div class="terminal-container"><table class="terminal-table" style="table-layout: fixed; width: 100%;">
+            <thead><tr>
+                <th style="width: 4%;"></th>
+                <th style="width: 12%;">Firm</th>
+                <th style="width: 10%;">Country</th>
+                <th style="width: 14%;">Area</th>
+                <th style="width: 50%;">Publication</th>
+                <th style="width: 10%;">Status</th>
+            </tr></thead><tbody>"""
+        table_footer = "</tbody></table></div>"
+        # Saved state of the visible rows only, read fresh so stars made in other sessions show up
+        saved_keys = get_saved_keys_among({link_key(link) for link in page_df['Link']})
+        st.markdown(table_header + render_table_rows(page_df, saved_keys) + table_footer, unsafe_allow_html=True)
         
-        # Functional Save Logic (Simplified for Streamlit: using a secondary button column for now or individual save buttons)
-        # To make it feel interactive, we'll add a 'Save All Visible' or eventually per-row components if needed.
-        # For now, let's just make the Dashboard functional.
+        # Pager, page size and star toggle for the visible rows
+        st.markdown('<div class="filter-section">', unsafe_allow_html=True)
+        col_prev, col_info, col_next, col_size, col_star = st.columns([0.6, 0.8, 0.6, 0.8, 2.2])
+        with col_prev:
+            st.button("◀ Prev", disabled=page == 0, on_click=turn_page, args=(-1,), use_container_width=True)
+        with col_info:
+            first = page * page_size + 1
+            st.markdown(f"<div style='padding-top: 8px; text-align: center; color: var(--terminal-muted); font-size: 12px;'>Page {page + 1} · items {first}–{first + len(page_df) - 1}</div>", unsafe_allow_html=True)
+        with col_next:
+            st.button("Next ▶", disabled=next_cursor is None, on_click=turn_page, args=(1, next_cursor), use_container_width=True)
+        with col_size:
+            st.selectbox("Rows per page", PAGE_SIZES, index=PAGE_SIZES.index(DEFAULT_PAGE_SIZE), key="dash_page_size",
+                         on_change=reset_dashboard_page, label_visibility="collapsed", format_func=lambda n: f"{n} per page")
+        with col_star:
+            st.selectbox("Star / unstar", list(page_df.index), index=None, key="dash_toggle",
+                         placeholder="☆ Star or unstar an item on this page",
+                         format_func=lambda i: ("⭐ " if link_key(page_df.at[i, 'Link']) in saved_keys else "☆ ") + str(page_df.at[i, 'Headline']),
+                         on_change=toggle_saved, args=(page_df,), label_visibility="collapsed")
+        st.markdown('</div>', unsafe_allow_html=True)
+    else:
+        empty_msg = "No matches for this search." if query.strip() else "The repository is empty. Use Sync Feeds to ingest the latest research."
+        st.markdown(f"<div style='padding: 100px; text-align: center; color: var(--terminal-muted);'>{empty_msg}</div>", unsafe_allow_html=True)
 
 # --- PAGE: SAVED ---
 elif st.session_state.current_page == "Saved":
     render_header("Knowledge Hub (Saved)")
-    saved_df = get_saved_articles()
+    saved_query = st.text_input("Search saved", placeholder="Search your saved research", label_visibility="collapsed")
+    if saved_query.strip():
+        saved_df = search_saved(saved_query.strip(), limit=SAVED_LIMIT)
+    else:
+        saved_df, _ = query_saved(limit=SAVED_LIMIT)
     
     if not saved_df.empty:
         st.markdown('<div class="terminal-container">', unsafe_allow_html=True)
@@ -348,7 +482,6 @@ elif st.session_state.current_page == "Saved":
             with row_col_save:
                 if st.button("🗑️", key=f"del_{idx}", help="Remove from Hub"):
                     remove_saved_article(link)
-                    st.session_state.saved_links.remove(link)
                     st.rerun()
 
             with row_col_content:
@@ -384,5 +517,76 @@ elif st.session_state.current_page == "Sources":
             else:
                 st.error("Domain already exists.")
 
+    # Latest fetch of every source (failing ones first), from the metrics recorded by each sync
+    st.subheader("Source Health")
+    health = get_source_health()
+    if health.empty:
+        st.caption("No syncs recorded yet. Health appears here after the next Sync Feeds.")
+    else:
+        failing = int(health["last_error"].notna().sum())
+        st.caption(f"{len(health)} sources · {failing} failing on their last fetch · avg latency {health['latency_ms'].mean():.0f} ms")
+        st.dataframe(health[["source", "status", "latency_ms", "bytes", "entries", "kept", "filtered",
+                             "error_ratio", "last_error", "last_fetch"]],
+                     use_container_width=True, hide_index=True)
+        # Sources skipped by their circuit breaker until the cooldown ends (see fetcher.fetch_cached)
+        breakers = get_open_breakers()
+        with st.expander(f"Paused sources ({len(breakers)})"):
+            if breakers.empty:
+                st.caption("No source is paused.")
+            else:
+                st.dataframe(breakers, use_container_width=True, hide_index=True)
+        with st.expander("Stage timings (latest run)"):
+            st.dataframe(get_stage_metrics(), use_container_width=True, hide_index=True)
+        with st.expander("Prometheus snapshot"):
+            from metrics import prometheus_text
+            st.code(prometheus_text(), language="text")
+
+# --- PAGE: ALERTS ---
+# Standing queries are checked against each newly ingested article (see alerts.py)
+elif st.session_state.current_page == "Alerts":
+    render_header("Alerts")
+    st.subheader("Standing Queries")
+    with st.form("add_alert_rule", clear_on_submit=True):
+        r_name = st.text_input("Rule Name")
+        r_query = st.text_input("Query", placeholder='firm=BCG AND topic=AI & Tech AND impact>=70   or   "supply chain" AND region=Europe')
+        if st.form_submit_button("Add Rule"):
+            try:
+                add_rule(r_name, r_query)
+                st.success("Rule added. It applies to articles ingested from now on.")
+            except ValueError as e:
+                st.error(f"Could not read the rule: {e}")
+    
+    rules = get_alert_rules()
+    if not rules.empty:
+        st.dataframe(rules[["name", "query", "active", "hits", "created_at"]], use_container_width=True, hide_index=True)
+        by_id = rules.set_index("id")
+        col_rule, col_toggle, col_delete = st.columns([3, 1, 1])
+        with col_rule:
+            rule_id = st.selectbox("Rule", list(by_id.index), label_visibility="collapsed",
+                                   format_func=lambda i: f"{by_id.at[i, 'name']} · {by_id.at[i, 'query']}")
+        with col_toggle:
+            paused = not by_id.at[rule_id, "active"]
+            if st.button("Resume" if paused else "Pause", use_container_width=True):
+                set_alert_rule_active(int(rule_id), paused)
+                st.rerun()
+        with col_delete:
+            if st.button("Delete Rule", use_container_width=True):
+                delete_alert_rule(int(rule_id))
+                st.rerun()
+    
+    st.subheader("Recent Alerts")
+    recent = get_alerts()
+    if recent.empty:
+        st.caption("No alerts yet. Matches appear here as new articles are ingested.")
+    else:
+        unread = int((recent["seen"] == 0).sum())
+        st.caption(f"{unread} unread")
+        st.dataframe(recent[["rule", "title", "firm", "topic", "impact", "published_date", "url", "created_at"]],
+                     use_container_width=True, hide_index=True,
+                     column_config={"url": st.column_config.LinkColumn("Link")})
+        if unread and st.button("Mark all as read"):
+            mark_alerts_seen()
+            st.rerun()
+
 # --- FOOTER ---
 render_bottom_nav()
@@ -0,0 +1,419 @@
+import argparse
+import contextlib
+import datetime
+import email.utils
+import hashlib
+import http.server
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+import feedparser
+import numpy as np
+import pandas as pd
+
+import database
+import dedup
+import engine
+import feedstream
+import fetcher
+import rss_aggregator
+import snapshots
+
+# --- CONFIGURATION ---
+DEFAULT_SOURCES = 40
+DEFAULT_ENTRIES = 30
+DEFAULT_SUMMARY_BYTES = 400
+DEFAULT_LATENCY_MS = 20
+DEFAULT_REPEAT = 3
+DEFAULT_OUTPUT = "benchmark.json"
+QUERY_ROUNDS = 50  # dashboard queries per query type
+RESCORE_ROWS = 100_000  # history size for the analyze() loop vs analyze_batch() comparison
+
+# Vocabulary mixes scoring / topic terms with filler so every code path gets exercised
+SIGNAL_WORDS = ["outlook", "forecast", "global", "strategic", "report", "transformation", "executive",
+                "ai", "inflation", "climate", "supply chain", "biotech", "regulation", "webinar", "career"]
+FILLER_WORDS = ["market", "company", "growth", "leaders", "insights", "customers", "survey", "value",
+                "industry", "investment", "capital", "risk", "performance", "platform", "model", "team"]
+REGIONS = ["Global", "US", "UK", "EU", "India", "APAC"]
+
+
+# --- SYNTHETIC FEED SERVER ---
+
+def make_feed(source, entries, summary_bytes, atom=False, seed=0):
+    """Deterministic RSS 2.0 (or Atom) document for one synthetic source."""
+    rng = random.Random(f"{seed}-{source}")
+    now = datetime.datetime(2026, 6, 1, tzinfo=datetime.timezone.utc)
+    items = []
+    for i in range(entries):
+        words = rng.sample(SIGNAL_WORDS, 2) + rng.sample(FILLER_WORDS, 5)
+        title = " ".join(words).capitalize() + f" {source}-{i} - Outlet {source % 7}"
+        body, size = [], 0
+        while size < summary_bytes:
+            body.append(rng.choice(FILLER_WORDS + SIGNAL_WORDS))
+            size += len(body[-1]) + 1
+        summary = " ".join(body)
+        link = f"https://example{source % 11}.com/insights/{source}/{i}?utm_source=rss"
+        published = now - datetime.timedelta(hours=i * 7 + source)
+        if atom:
+            items.append(f"<entry><title>{title}</title><link rel='alternate' href='{link}'/>"
+                         f"<id>urn:bench:{source}:{i}</id><updated>{published.isoformat()}</updated>"
+                         f"<summary>{summary}</summary></entry>")
+        else:
+            items.append(f"<item><title>{title}</title><link>{link}</link><guid>bench-{source}-{i}</guid>"
+                         f"<pubDate>{email.utils.format_datetime(published)}</pubDate>"
+                         f"<description>&lt;b&gt;{summary}&lt;/b&gt;</description></item>")
+    if atom:
+        doc = f"<?xml version='1.0'?><feed xmlns='http://www.w3.org/2005/Atom'><title>Source {source}</title>{''.join(items)}</feed>"
+    else:
+        doc = f"<?xml version='1.0'?><rss version='2.0'><channel><title>Source {source}</title>{''.join(items)}</channel></rss>"
+    return doc.encode("utf-8")
+
+
+class FeedServer:
+    """
+    Local stand-in for the feed providers: serves /feed/<n> on 127.0.0.1 with a
+    configurable delay, error rate and payload. Honours If-None-Match like a real CDN.
+    """
+
+    def __init__(self, entries=DEFAULT_ENTRIES, summary_bytes=DEFAULT_SUMMARY_BYTES, latency_ms=DEFAULT_LATENCY_MS,
+                 jitter_ms=0, error_rate=0.0, atom_share=0.0, seed=0):
+        self.entries = entries
+        self.summary_bytes = summary_bytes
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.atom_share = atom_share
+        self.seed = seed
+        self._rng = random.Random(seed)
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def body(self, source):
+        with self._lock:
+            if source not in self._bodies:
+                atom = random.Random(f"atom-{self.seed}-{source}").random() < self.atom_share
+                self._bodies[source] = make_feed(source, self.entries, self.summary_bytes, atom, self.seed)
+            return self._bodies[source]
+
+    def _handler(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    delay = max(0.0, server.latency_ms + server._rng.uniform(-1, 1) * server.jitter_ms) / 1000
+                    failed = server._rng.random() < server.error_rate
+                time.sleep(delay)
+                if failed:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                try:
+                    source = int(self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1])
+                except ValueError:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = server.body(source)
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/xml")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def url(self, source):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/feed/{source}"
+
+    def sources(self, count):
+        """A sources.csv-shaped DataFrame pointing at this server. Payloads are generated up front."""
+        for i in range(count):
+            self.body(i)
+        return pd.DataFrame([
+            {"name": f"Bench Source {i}", "region": REGIONS[i % len(REGIONS)], "strategy": "direct", "query": self.url(i)}
+            for i in range(count)
+        ])
+
+
+# --- MEASUREMENT ---
+
+def summarize(samples, items=None):
+    """Latency percentiles (ms) and throughput for a list of per-call durations in seconds."""
+    samples = np.asarray(samples, dtype=float)
+    if samples.size == 0:
+        return {"calls": 0}
+    total = float(samples.sum())
+    items = samples.size if items is None else items
+    return {
+        "calls": int(samples.size),
+        "items": int(items),
+        "total_s": round(total, 4),
+        "throughput_per_s": round(items / total, 1) if total > 0 else None,
+        "p50_ms": round(float(np.percentile(samples, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(samples, 95)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(samples, 99)) * 1000, 3),
+        "max_ms": round(float(samples.max()) * 1000, 3),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    value = fn(*args, **kwargs)
+    return time.perf_counter() - start, value
+
+
+@contextlib.contextmanager
+def scratch_store():
+    """Points the database and snapshot store at a throwaway directory."""
+    workdir = tempfile.mkdtemp(prefix="kb-bench-")
+    saved = database.DB_PATH, snapshots.SNAPSHOT_DIR, rss_aggregator.SOURCES_PATH
+    database.DB_PATH = os.path.join(workdir, "bench.db")
+    snapshots.SNAPSHOT_DIR = os.path.join(workdir, "snapshots")
+    rss_aggregator.SOURCES_PATH = os.path.join(workdir, "sources.csv")
+    try:
+        database.init_db()
+        yield workdir
+    finally:
+        database.close_connection()
+        database.DB_PATH, snapshots.SNAPSHOT_DIR, rss_aggregator.SOURCES_PATH = saved
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# --- STAGES ---
+
+def bench_fetch(server, sources_df, workers):
+    urls = [server.url(i) for i in range(len(sources_df))]
+    elapsed, results = timed(fetcher.fetch_feeds, urls, workers=workers, snapshot=False)
+    ok = [r for r in results if not r["error"]]
+    stats = summarize([r["elapsed"] for r in results])
+    # Requests overlap, so throughput comes from wall time, not the sum of latencies
+    stats.update({"wall_s": round(elapsed, 4), "throughput_per_s": round(len(results) / elapsed, 1),
+                  "errors": len(results) - len(ok)})
+    return stats
+
+
+def bench_parse(server, count):
+    bodies = [server.body(i) for i in range(count)]
+    full = [timed(feedparser.parse, body)[0] for body in bodies]
+    chunked = lambda body: [body[i:i + feedstream.CHUNK_SIZE] for i in range(0, len(body), feedstream.CHUNK_SIZE)]
+    streamed = [timed(feedstream.parse_stream, chunked(body), engine.MAX_ENTRIES)[0] for body in bodies]
+    return {
+        "feedparser": summarize(full),
+        "stream_top_n": summarize(streamed),
+        "bytes_per_feed": int(np.mean([len(b) for b in bodies])),
+    }
+
+
+def sample_entries(server, count):
+    entries = []
+    for i in range(count):
+        for entry in feedparser.parse(server.body(i)).entries:
+            entries.append(engine.clean_entry(entry))
+    return entries
+
+
+def bench_score(entries):
+    scorer = engine.ImpactScorer()
+    per_entry = [timed(scorer.analyze, title, summary)[0] for title, summary in entries]
+    titles, summaries = zip(*entries)
+    batch, _ = timed(scorer.analyze_batch, list(titles), list(summaries))
+    stats = summarize(per_entry)
+    stats["batch_s"] = round(batch, 4)
+    stats["batch_items_per_s"] = round(len(entries) / batch, 1) if batch > 0 else None
+    return stats
+
+
+def bench_rescore(entries, rows=RESCORE_ROWS):
+    """Rescoring a history of `rows` headlines: a loop over analyze() against one analyze_batch()."""
+    scorer = engine.ImpactScorer()
+    titles, summaries = zip(*entries)
+    titles, summaries = list(titles) * (rows // len(entries) + 1), list(summaries) * (rows // len(entries) + 1)
+    titles, summaries = titles[:rows], summaries[:rows]
+    loop_s, expected = timed(lambda: [scorer.analyze(t, s) for t, s in zip(titles, summaries)])
+    batch_s, (scores, topics) = timed(scorer.analyze_batch, titles, summaries)
+    if list(zip(scores.tolist(), topics.tolist())) != expected:
+        raise AssertionError("analyze_batch() disagrees with analyze()")
+    return {"rows": rows, "loop_s": round(loop_s, 3), "batch_s": round(batch_s, 3),
+            "speedup": round(loop_s / batch_s, 2) if batch_s > 0 else None}
+
+
+def bench_classify(entries):
+    return summarize([timed(engine.classify_topic, title, summary)[0] for title, summary in entries])
+
+
+def bench_dedup(entries):
+    per_entry = [timed(dedup.simhash, title, summary)[0] for title, summary in entries]
+    rows = [{"Headline": t, "Summary": s, "Impact": i % 100, "Link": f"https://example.com/{i}"}
+            for i, (t, s) in enumerate(entries)]
+    fingerprints = dedup.fingerprint_rows(rows, "Headline", "Summary")
+    collapse_s, (kept, _) = timed(dedup.collapse, rows, fingerprints, "Impact", "Link")
+    stats = summarize(per_entry)
+    stats.update({"collapse_s": round(collapse_s, 4), "kept": len(kept)})
+    return stats
+
+
+def bench_db_write(entries, batch_size=200):
+    articles = [{
+        "url": f"https://bench.example.com/a/{i}", "title": title, "firm": f"Bench Source {i % 40}",
+        "published_date": datetime.date(2026, 6, 1) - datetime.timedelta(days=i % 60), "summary": summary,
+        "impact_score": (i * 37) % 100, "region": REGIONS[i % len(REGIONS)], "topic": engine.classify_topic(title, summary),
+        "guid": f"bench-{i}"
+    } for i, (title, summary) in enumerate(entries)]
+    batches = [articles[i:i + batch_size] for i in range(0, len(articles), batch_size)]
+    inserts = [timed(database.upsert_articles, batch)[0] for batch in batches]
+    # Second pass hits the unchanged-row path of the upsert
+    refreshes = [timed(database.upsert_articles, batch)[0] for batch in batches]
+    return {"insert": summarize(inserts, len(articles)), "refresh": summarize(refreshes, len(articles)),
+            "batch_size": batch_size}
+
+
+def bench_queries(rounds=QUERY_ROUNDS):
+    regions, topics = database.get_filter_options()
+    first_page, cursor = database.query_articles(limit=50)
+    cases = {
+        "filter_options": lambda: database.get_filter_options(),
+        "first_page": lambda: database.query_articles(limit=50),
+        "filtered_page": lambda: database.query_articles(region=regions[0] if regions else None,
+                                                         topic=topics[0] if topics else None, limit=50),
+        "next_page": lambda: database.query_articles(after=cursor, limit=50),
+        "search": lambda: database.search_articles("strategic outlook", limit=50),
+        "seen_keys": lambda: database.get_seen_keys(first_page["Link"].tolist()),
+    }
+    return {name: summarize([timed(fn)[0] for _ in range(rounds)]) for name, fn in cases.items()}
+
+
+def bench_pipelines(server, sources_df, workers, repeat, parse_workers=fetcher.PARSE_WORKERS):
+    """End to end: cold runs (empty feed cache) and warm runs (every feed answers 304)."""
+    sources_df.to_csv(rss_aggregator.SOURCES_PATH, index=False)
+    clear_cache = lambda: database.get_connection().execute("DELETE FROM feed_cache")
+    timings = {name: [] for name in ("fetch_and_rank_cold", "fetch_and_rank_warm", "ingest_cold",
+                                     "run_aggregator_cold", "run_aggregator_warm")}
+    for _ in range(repeat):
+        clear_cache()
+        timings["fetch_and_rank_cold"].append(timed(engine.fetch_and_rank, sources_df, workers, parse_workers=parse_workers)[0])
+        timings["fetch_and_rank_warm"].append(timed(engine.fetch_and_rank, sources_df, workers, parse_workers=parse_workers)[0])
+        clear_cache()
+        timings["ingest_cold"].append(timed(engine.ingest, sources_df, workers, parse_workers)[0])
+        with contextlib.redirect_stdout(io.StringIO()):
+            clear_cache()
+            timings["run_aggregator_cold"].append(timed(rss_aggregator.run_aggregator, workers, parse_workers=parse_workers)[0])
+            timings["run_aggregator_warm"].append(timed(rss_aggregator.run_aggregator, workers, parse_workers=parse_workers)[0])
+    return {name: summarize(samples, len(sources_df) * len(samples)) for name, samples in timings.items()}
+
+
+def run(sources=DEFAULT_SOURCES, entries=DEFAULT_ENTRIES, summary_bytes=DEFAULT_SUMMARY_BYTES,
+        latency_ms=DEFAULT_LATENCY_MS, jitter_ms=0, error_rate=0.0, atom_share=0.0, workers=fetcher.DEFAULT_WORKERS,
+        repeat=DEFAULT_REPEAT, seed=0, parse_workers=fetcher.PARSE_WORKERS):
+    """Runs every stage against a fresh synthetic server and scratch database. Returns the report dict."""
+    config = {"sources": sources, "entries": entries, "summary_bytes": summary_bytes, "latency_ms": latency_ms,
+              "jitter_ms": jitter_ms, "error_rate": error_rate, "atom_share": atom_share, "workers": workers,
+              "parse_workers": parse_workers, "repeat": repeat, "seed": seed}
+    server = FeedServer(entries, summary_bytes, latency_ms, jitter_ms, error_rate, atom_share, seed).start()
+    try:
+        with scratch_store():
+            sources_df = server.sources(sources)
+            entry_texts = sample_entries(server, sources)
+            stages = {
+                "fetch": bench_fetch(server, sources_df, workers),
+                "parse": bench_parse(server, sources),
+                "score": bench_score(entry_texts),
+                "rescore": bench_rescore(entry_texts),
+                "classify": bench_classify(entry_texts),
+                "dedup": bench_dedup(entry_texts),
+                "db_write": bench_db_write(entry_texts),
+                "dashboard_query": bench_queries(),
+                "pipeline": bench_pipelines(server, sources_df, workers, repeat, parse_workers),
+            }
+    finally:
+        server.stop()
+    return {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "stages": stages,
+    }
+
+
+def print_report(report):
+    def rows(prefix, node):
+        if "p50_ms" in node:
+            yield prefix, node
+            return
+        for key, value in node.items():
+            if isinstance(value, dict):
+                yield from rows(f"{prefix}.{key}" if prefix else key, value)
+
+    print(f"commit {report['commit']}  {report['timestamp']}  {report['config']}")
+    print(f"{'stage':<36}{'calls':>7}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in rows("", report["stages"]):
+        rate = stats.get("throughput_per_s")
+        print(f"{name:<36}{stats['calls']:>7}{rate if rate is not None else '-':>12}"
+              f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+    rescore = report["stages"].get("rescore")
+    if rescore:
+        print(f"rescore {rescore['rows']} rows: analyze() loop {rescore['loop_s']}s, "
+              f"analyze_batch() {rescore['batch_s']}s ({rescore['speedup']}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the feed pipeline against a local synthetic RSS server.")
+    parser.add_argument("--sources", type=int, default=DEFAULT_SOURCES, help="Number of synthetic sources")
+    parser.add_argument("--entries", type=int, default=DEFAULT_ENTRIES, help="Entries per feed")
+    parser.add_argument("--summary-bytes", type=int, default=DEFAULT_SUMMARY_BYTES, help="Approximate summary size per entry")
+    parser.add_argument("--latency-ms", type=float, default=DEFAULT_LATENCY_MS, help="Server response delay")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="Random +/- spread on the delay")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--atom-share", type=float, default=0.0, help="Share of sources served as Atom instead of RSS")
+    parser.add_argument("--workers", type=int, default=fetcher.DEFAULT_WORKERS, help="Concurrent fetch workers")
+    parser.add_argument("--parse-workers", type=int, default=fetcher.PARSE_WORKERS, help="Parse/score processes (0 or 1 = in-process)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="End-to-end runs per pipeline")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for payloads, latency and errors")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    report = run(args.sources, args.entries, args.summary_bytes, args.latency_ms, args.jitter_ms, args.error_rate,
+                 args.atom_share, args.workers, args.repeat, args.seed, args.parse_workers)
+    print_report(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {args.output}")
@@ -0,0 +1,95 @@
+import ipaddress
+import urllib.parse
+
+
+def _host_and_path(url):
+    parts = urllib.parse.urlsplit(url.strip().lower())
+    if not parts.netloc and "/" not in parts.path.split(".", 1)[0]:
+        # Bare "example.com/path" without a scheme
+        parts = urllib.parse.urlsplit("//" + url.strip().lower())
+    return (parts.hostname or "").rstrip("."), parts.path or "/"
+
+
+class DomainBlocklist:
+    """
+    Host-based URL blocklist. Rules take three forms:
+      example.com         the host and all of its subdomains
+      login.              any host with a "login" label before its TLD (login.x.com, www.login.io)
+      example.com/path    URLs under that host (or its subdomains) whose path is /path or below it
+    A URL is parsed once and checked against one hash-set lookup per host label,
+    so the cost per link does not grow with the number of rules.
+    """
+
+    def __init__(self, rules=()):
+        self._domains = set()
+        self._labels = set()
+        self._paths = {}  # domain -> path prefixes
+        self.size = 0
+        self.add_rules(rules)
+
+    def add(self, rule):
+        rule = rule.strip().lower()
+        if not rule:
+            return
+        if rule.endswith(".") and "/" not in rule:
+            self._labels.add(rule.rstrip("."))
+        else:
+            host, path = _host_and_path(rule)
+            if not host:
+                return
+            path = path.rstrip("/")
+            if path:
+                self._paths.setdefault(host, []).append(path)
+            else:
+                self._domains.add(host)
+        self.size += 1
+
+    def add_rules(self, rules):
+        for rule in rules:
+            self.add(rule)
+
+    def load(self, path):
+        """
+        Adds rules from a file, one per line. Besides the rule forms above it reads
+        hosts-file lines ("0.0.0.0 example.com") and adblock domain rules ("||example.com^"),
+        so public blocklists can be used as they are. '#' and '!' start comments.
+        """
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.split("#", 1)[0].strip()
+                if not line or line.startswith("!"):
+                    continue
+                fields = line.split()
+                if len(fields) > 1 and _is_ip(fields[0]):
+                    self.add_rules(fields[1:])
+                elif line.startswith("||"):
+                    self.add(line[2:].split("^", 1)[0])
+                else:
+                    self.add(fields[0])
+        return self
+
+    def blocks(self, url):
+        """True if the URL's host or host + path matches a rule."""
+        host, path = _host_and_path(url or "")
+        if not host:
+            return False
+        labels = host.split(".")
+        if any(label in self._labels for label in labels[:-1]):
+            return True
+        for i in range(len(labels)):
+            suffix = ".".join(labels[i:])
+            if suffix in self._domains:
+                return True
+            prefixes = self._paths.get(suffix)
+            # Whole segments only: /en-us/account covers /en-us/account/x, not /en-us/accounting
+            if prefixes and any(path == p or path.startswith(p + "/") for p in prefixes):
+                return True
+        return False
+
+
+def _is_ip(text):
+    try:
+        ipaddress.ip_address(text)
+        return True
+    except ValueError:
+        return False
@@ -1,13 +1,117 @@
 import sqlite3
 import pandas as pd
 import os
+import json
+import re
+import datetime
+import queue
+import threading
+import time
+import uuid
+import weakref
+from contextlib import contextmanager
+from urls import link_key
 
 DB_PATH = "research.db"
 
+# --- CONNECTION LAYER ---
+BUSY_TIMEOUT_MS = 5000
+PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",  # only takes effect on a new file; retention.py converts old ones
+    "journal_mode": "WAL",      # readers no longer block the writer (and vice versa)
+    "synchronous": "NORMAL",    # safe with WAL, far fewer fsyncs
+    "busy_timeout": BUSY_TIMEOUT_MS,
+    "cache_size": -16000,       # ~16 MB page cache per connection
+    "temp_store": "MEMORY",
+}
+
+POOL_SIZE = 8  # idle connections kept per database file
+
+_local = threading.local()
+_write_lock = threading.RLock()
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _open_connection(path):
+    # Autocommit mode: writes are grouped explicitly by transaction().
+    # check_same_thread is off because pooled connections move between threads (one at a time).
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+    for name, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    # Lets SQL (migrations, ad-hoc queries) compute the same canonical link key as Python
+    conn.create_function("link_key", 1, link_key, deterministic=True)
+    return conn
+
+def _pool(path):
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = queue.LifoQueue(POOL_SIZE)  # most recently used first: its page cache is warm
+        return _pools[path]
+
+def _release(path, conn):
+    try:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        _pool(path).put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.close()
+
+class _Lease:
+    """A pooled connection held by one thread; goes back to the pool when the thread ends."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.conn = _pool(path).get_nowait()
+        except queue.Empty:
+            self.conn = _open_connection(path)
+        self.release = weakref.finalize(self, _release, path, self.conn)
+
+def get_connection():
+    """
+    Returns this thread's connection to DB_PATH. Each thread leases one from a pool
+    and keeps it for its lifetime; when the thread ends the connection is handed to
+    the next one, already open and tuned. Streamlit runs every rerun on a fresh
+    thread, so without the pool each click would reopen the file and replay PRAGMAS.
+    A lease for an old DB_PATH is returned and a new one taken if DB_PATH changes.
+    """
+    lease = getattr(_local, "lease", None)
+    if lease is None or lease.path != DB_PATH:
+        if lease is not None:
+            lease.release()
+        lease = _local.lease = _Lease(DB_PATH)
+    return lease.conn
+
+def close_connection():
+    """Closes this thread's connection, if any, instead of returning it to the pool."""
+    lease = getattr(_local, "lease", None)
+    if lease is not None:
+        lease.release.detach()
+        lease.conn.close()
+        _local.lease = None
+
+@contextmanager
+def transaction():
+    """
+    Runs a block of writes as one IMMEDIATE transaction. Writers in this process
+    are serialized by a lock; other processes wait up to the busy timeout.
+    """
+    conn = get_connection()
+    with _write_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
+    with transaction() as conn:
+        _create_schema(conn.cursor())
+        _migrate(conn)
+
+def _create_schema(cursor):
     # Saved Items Table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS saved_items (
@@ -33,62 +137,1075 @@ def init_db():
             last_sync TIMESTAMP
         )
     ''')
+    # Fetch settings and adaptive polling state (sources.csv rows are registered here too)
+    _add_missing_columns(cursor, "sources", {
+        "region": "TEXT",
+        "strategy": "TEXT",
+        "query": "TEXT",
+        "poll_interval": "REAL",
+        "next_poll": "REAL"
+    })
     
-    conn.commit()
-    conn.close()
+    # Ingested Articles Table (written by the engine and the aggregator, read by the Dashboard)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS articles (
+            url TEXT PRIMARY KEY,
+            title TEXT,
+            firm TEXT,
+            published_date DATE,
+            summary TEXT,
+            impact_score INTEGER,
+            region TEXT
+        )
+    ''')
+    _add_missing_columns(cursor, "articles", {
+        "topic": "TEXT",
+        "guid": "TEXT",
+        "ingested_at": "TIMESTAMP"
+    })
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_articles_guid ON articles (guid)")
+    
+    # Feed Cache Table (conditional GET validators + last processed rows, per feed URL).
+    # Keyed by namespace too, since the engine and the aggregator keep different row shapes.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS feed_cache (
+            namespace TEXT NOT NULL,
+            url TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            entries TEXT,
+            last_sync TIMESTAMP,
+            PRIMARY KEY (namespace, url)
+        )
+    ''')
+
+# --- SCHEMA MIGRATIONS ---
+# Applied in order on top of the base schema; PRAGMA user_version records the last one run.
+# Append new steps, never edit released ones.
+MIGRATIONS = [
+    # 1: indexes behind the Dashboard / Saved query API (filters + keyset pagination)
+    [
+        "CREATE INDEX IF NOT EXISTS idx_articles_rank ON articles (impact_score DESC, published_date DESC, url DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_date ON articles (published_date DESC, impact_score DESC, url DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_region_rank ON articles (region, impact_score DESC, published_date DESC, url DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_topic_rank ON articles (topic, impact_score DESC, published_date DESC, url DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_firm_rank ON articles (firm, impact_score DESC, published_date DESC, url DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_saved_items_saved_at ON saved_items (saved_at DESC, id DESC)",
+    ],
+    # 2: FTS5 search over articles and saved items (external content, kept in sync by triggers).
+    # articles_fts follows articles.rowid (stable across VACUUM since migration 13 made it link_key).
+    [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+            title, summary, firm, topic, content='articles', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2')""",
+        """CREATE TRIGGER IF NOT EXISTS articles_fts_insert AFTER INSERT ON articles BEGIN
+            INSERT INTO articles_fts (rowid, title, summary, firm, topic)
+            VALUES (new.rowid, new.title, new.summary, new.firm, new.topic);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS articles_fts_delete AFTER DELETE ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, summary, firm, topic)
+            VALUES ('delete', old.rowid, old.title, old.summary, old.firm, old.topic);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS articles_fts_update AFTER UPDATE OF title, summary, firm, topic ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, summary, firm, topic)
+            VALUES ('delete', old.rowid, old.title, old.summary, old.firm, old.topic);
+            INSERT INTO articles_fts (rowid, title, summary, firm, topic)
+            VALUES (new.rowid, new.title, new.summary, new.firm, new.topic);
+        END""",
+        "INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')",
+        """CREATE VIRTUAL TABLE IF NOT EXISTS saved_fts USING fts5(
+            headline, firm, topic, content='saved_items', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2')""",
+        """CREATE TRIGGER IF NOT EXISTS saved_fts_insert AFTER INSERT ON saved_items BEGIN
+            INSERT INTO saved_fts (rowid, headline, firm, topic) VALUES (new.id, new.headline, new.firm, new.topic);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS saved_fts_delete AFTER DELETE ON saved_items BEGIN
+            INSERT INTO saved_fts (saved_fts, rowid, headline, firm, topic)
+            VALUES ('delete', old.id, old.headline, old.firm, old.topic);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS saved_fts_update AFTER UPDATE OF headline, firm, topic ON saved_items BEGIN
+            INSERT INTO saved_fts (saved_fts, rowid, headline, firm, topic)
+            VALUES ('delete', old.id, old.headline, old.firm, old.topic);
+            INSERT INTO saved_fts (rowid, headline, firm, topic) VALUES (new.id, new.headline, new.firm, new.topic);
+        END""",
+        "INSERT INTO saved_fts (saved_fts) VALUES ('rebuild')",
+    ],
+    # 3: SimHash fingerprints for near-duplicate detection, one indexed column per LSH band
+    [
+        """CREATE TABLE IF NOT EXISTS fingerprints (
+            url TEXT PRIMARY KEY,
+            simhash INTEGER NOT NULL,
+            band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_fingerprints_band0 ON fingerprints (band0)",
+        "CREATE INDEX IF NOT EXISTS idx_fingerprints_band1 ON fingerprints (band1)",
+        "CREATE INDEX IF NOT EXISTS idx_fingerprints_band2 ON fingerprints (band2)",
+        "CREATE INDEX IF NOT EXISTS idx_fingerprints_band3 ON fingerprints (band3)",
+    ],
+    # 4: 64-bit canonical link keys (see urls.py). Backfill, fold rows whose links only differed
+    # by tracking parameters (keeping the best / earliest copy), then make the keys unique.
+    [
+        "ALTER TABLE articles ADD COLUMN link_key INTEGER",
+        "UPDATE articles SET link_key = link_key(url)",
+        """DELETE FROM articles WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, ROW_NUMBER() OVER (PARTITION BY link_key ORDER BY impact_score DESC, rowid) AS n
+                FROM articles
+            ) WHERE n > 1
+        )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_articles_link_key ON articles (link_key)",
+        "ALTER TABLE saved_items ADD COLUMN link_key INTEGER",
+        "UPDATE saved_items SET link_key = link_key(link)",
+        "DELETE FROM saved_items WHERE id NOT IN (SELECT MIN(id) FROM saved_items GROUP BY link_key)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_saved_items_link_key ON saved_items (link_key)",
+    ],
+    # 5: index of raw feed snapshots (see snapshots.py); the bodies live on disk, one file per digest
+    [
+        """CREATE TABLE IF NOT EXISTS snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            size INTEGER,
+            fetched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_snapshots_url_time ON snapshots (url, fetched_at)",
+        "CREATE INDEX IF NOT EXISTS idx_snapshots_time ON snapshots (fetched_at)",
+    ],
+    # 6: pipeline instrumentation (see metrics.py), pruned to METRICS_RETENTION_DAYS
+    [
+        """CREATE TABLE IF NOT EXISTS source_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            pipeline TEXT,
+            source TEXT,
+            url TEXT,
+            status INTEGER,
+            latency_ms REAL,
+            bytes INTEGER,
+            entries INTEGER,
+            kept INTEGER,
+            filtered INTEGER,
+            error TEXT,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_source_metrics_url ON source_metrics (url, id)",
+        "CREATE INDEX IF NOT EXISTS idx_source_metrics_time ON source_metrics (recorded_at)",
+        """CREATE TABLE IF NOT EXISTS stage_metrics (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            pipeline TEXT,
+            stage TEXT,
+            seconds REAL,
+            calls INTEGER,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_stage_metrics_pipeline ON stage_metrics (pipeline, id)",
+        "CREATE INDEX IF NOT EXISTS idx_stage_metrics_time ON stage_metrics (recorded_at)",
+    ],
+    # 7: shared fetch queue for distributed aggregator workers: one row per source per round
+    [
+        """CREATE TABLE IF NOT EXISTS fetch_queue (
+            round_id TEXT NOT NULL,
+            source_id INTEGER NOT NULL,
+            owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            done_at REAL,
+            PRIMARY KEY (round_id, source_id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_fetch_queue_open ON fetch_queue (round_id, done_at, lease_expires)",
+    ],
+    # 8: change counter of articles, bumped by triggers, so derived artifacts (exports) know when they're stale
+    [
+        "CREATE TABLE IF NOT EXISTS data_versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)",
+        "INSERT OR IGNORE INTO data_versions (name, version) VALUES ('articles', 0)",
+        """CREATE TRIGGER IF NOT EXISTS articles_version_ai AFTER INSERT ON articles BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'articles';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS articles_version_au AFTER UPDATE ON articles BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'articles';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS articles_version_ad AFTER DELETE ON articles BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'articles';
+        END""",
+    ],
+    # 9: keys of articles moved to the archive partitions (see retention.py), so they still count as seen
+    [
+        "CREATE TABLE IF NOT EXISTS archived_keys (link_key INTEGER PRIMARY KEY, partition TEXT NOT NULL)",
+    ],
+    # 10: standing-query alerts (see alerts.py); rule edits bump a data version so the index is rebuilt
+    [
+        """CREATE TABLE IF NOT EXISTS alert_rules (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            query TEXT NOT NULL,
+            active INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rule_id INTEGER NOT NULL,
+            link_key INTEGER NOT NULL,
+            url TEXT,
+            title TEXT,
+            firm TEXT,
+            topic TEXT,
+            impact INTEGER,
+            published_date DATE,
+            seen INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (rule_id, link_key)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_alerts_seen ON alerts (seen, id)",
+        "INSERT OR IGNORE INTO data_versions (name, version) VALUES ('alert_rules', 0)",
+        """CREATE TRIGGER IF NOT EXISTS alert_rules_version_ai AFTER INSERT ON alert_rules BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'alert_rules';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS alert_rules_version_au AFTER UPDATE ON alert_rules BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'alert_rules';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS alert_rules_version_ad AFTER DELETE ON alert_rules BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'alert_rules';
+            DELETE FROM alerts WHERE rule_id = old.id;
+        END""",
+    ],
+    # 11: per-source circuit breakers (see fetcher.fetch_cached), keyed by feed URL like feed_cache
+    [
+        """CREATE TABLE IF NOT EXISTS feed_state (
+            url TEXT PRIMARY KEY,
+            failures INTEGER NOT NULL DEFAULT 0,
+            empty_syncs INTEGER NOT NULL DEFAULT 0,
+            trips INTEGER NOT NULL DEFAULT 0,
+            open_until REAL,
+            reason TEXT,
+            last_error TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_feed_state_open ON feed_state (open_until)",
+    ],
+    # 12: sources.csv rows are keyed by their own query, not by a copy of it in domain.
+    # SQLite can't relax NOT NULL in place, so the table is rebuilt with domain nullable.
+    [
+        """CREATE TABLE sources_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            domain TEXT UNIQUE,
+            category TEXT,
+            last_sync TIMESTAMP,
+            region TEXT,
+            strategy TEXT,
+            query TEXT,
+            poll_interval REAL,
+            next_poll REAL
+        )""",
+        """INSERT INTO sources_new (id, name, domain, category, last_sync, region, strategy, query, poll_interval, next_poll)
+            SELECT id, name, CASE WHEN domain = query THEN NULL ELSE domain END, category, last_sync,
+                   region, strategy, query, poll_interval, next_poll
+            FROM sources""",
+        "DROP TABLE sources",
+        "ALTER TABLE sources_new RENAME TO sources",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_sources_query ON sources (query)",
+    ],
+    # 13: articles and fingerprints keyed by link_key (INTEGER PRIMARY KEY, i.e. the rowid) instead
+    # of url text. The rank indexes end in the 8-byte key, not the URL, and articles_fts follows a
+    # rowid that VACUUM can't renumber. Dropping the old tables drops their indexes and triggers,
+    # so those are recreated here.
+    [
+        """CREATE TABLE articles_new (
+            link_key INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            title TEXT,
+            firm TEXT,
+            published_date DATE,
+            summary TEXT,
+            impact_score INTEGER,
+            region TEXT,
+            topic TEXT,
+            guid TEXT,
+            ingested_at TIMESTAMP
+        )""",
+        """INSERT OR IGNORE INTO articles_new
+            (link_key, url, title, firm, published_date, summary, impact_score, region, topic, guid, ingested_at)
+            SELECT COALESCE(link_key, link_key(url)), url, title, firm, published_date, summary, impact_score,
+                   region, topic, guid, ingested_at
+            FROM articles""",
+        "DROP TABLE articles",
+        "ALTER TABLE articles_new RENAME TO articles",
+        "CREATE INDEX IF NOT EXISTS idx_articles_guid ON articles (guid)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_rank ON articles (impact_score DESC, published_date DESC, link_key DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_date ON articles (published_date DESC, impact_score DESC, link_key DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_region_rank ON articles (region, impact_score DESC, published_date DESC, link_key DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_topic_rank ON articles (topic, impact_score DESC, published_date DESC, link_key DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_articles_firm_rank ON articles (firm, impact_score DESC, published_date DESC, link_key DESC)",
+        """CREATE TRIGGER IF NOT EXISTS articles_fts_insert AFTER INSERT ON articles BEGIN
+            INSERT INTO articles_fts (rowid, title, summary, firm, topic)
+            VALUES (new.rowid, new.title, new.summary, new.firm, new.topic);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS articles_fts_delete AFTER DELETE ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, summary, firm, topic)
+            VALUES ('delete', old.rowid, old.title, old.summary, old.firm, old.topic);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS articles_fts_update AFTER UPDATE OF title, summary, firm, topic ON articles BEGIN
+            INSERT INTO articles_fts (articles_fts, rowid, title, summary, firm, topic)
+            VALUES ('delete', old.rowid, old.title, old.summary, old.firm, old.topic);
+            INSERT INTO articles_fts (rowid, title, summary, firm, topic)
+            VALUES (new.rowid, new.title, new.summary, new.firm, new.topic);
+        END""",
+        "INSERT INTO articles_fts (articles_fts) VALUES ('rebuild')",
+        """CREATE TRIGGER IF NOT EXISTS articles_version_ai AFTER INSERT ON articles BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'articles';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS articles_version_au AFTER UPDATE ON articles BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'articles';
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS articles_version_ad AFTER DELETE ON articles BEGIN
+            UPDATE data_versions SET version = version + 1 WHERE name = 'articles';
+        END""",
+        "UPDATE data_versions SET version = version + 1 WHERE name = 'articles'",
+        """CREATE TABLE fingerprints_new (
+            link_key INTEGER PRIMARY KEY,
+            simhash INTEGER NOT NULL,
+            band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )""",
+        """INSERT OR REPLACE INTO fingerprints_new (link_key, simhash, band0, band1, band2, band3, created_at)
+            SELECT link_key(url), simhash, band0, band1, band2, band3, created_at FROM fingerprints ORDER BY created_at""",
+        "DROP TABLE fingerprints",
+        "ALTER TABLE fingerprints_new RENAME TO fingerprints",
+        "CREATE INDEX IF NOT EXISTS idx_fingerprints_band0 ON fingerprints (band0)",
+        "CREATE INDEX IF NOT EXISTS idx_fingerprints_band1 ON fingerprints (band1)",
+        "CREATE INDEX IF NOT EXISTS idx_fingerprints_band2 ON fingerprints (band2)",
+        "CREATE INDEX IF NOT EXISTS idx_fingerprints_band3 ON fingerprints (band3)",
+    ],
+]
+
+def _migrate(conn):
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for sql in statements:
+            conn.execute(sql)
+        conn.execute(f"PRAGMA user_version = {number}")
+
+def get_schema_version():
+    return get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+def _add_missing_columns(cursor, table, columns):
+    """Lightweight migration: adds any of `columns` ({name: type}) that the table lacks."""
+    existing = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for name, col_type in columns.items():
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+
+def _saved_item(article_data):
+    return (
+        link_key(article_data['Link']),
+        article_data['Headline'], 
+        article_data['Link'], 
+        article_data['Firm'], 
+        article_data['Region'], 
+        article_data['Topic'], 
+        article_data['Impact'],
+        article_data['Date']
+    )
+
+def save_articles(articles):
+    """Saves many Dashboard rows to saved_items in one transaction. Returns how many were new."""
+    # rowcount rather than total_changes: the latter also counts the FTS triggers' writes
+    with transaction() as conn:
+        return conn.executemany('''
+            INSERT OR IGNORE INTO saved_items (link_key, headline, link, firm, region, topic, impact, publication_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [_saved_item(a) for a in articles]).rowcount
 
 def save_article(article_data):
     """Saves an article to the saved_items table."""
-    conn = sqlite3.connect(DB_PATH)
-    try:
-        conn.execute('''
-            INSERT INTO saved_items (headline, link, firm, region, topic, impact, publication_date)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            article_data['Headline'], 
-            article_data['Link'], 
-            article_data['Firm'], 
-            article_data['Region'], 
-            article_data['Topic'], 
-            article_data['Impact'],
-            article_data['Date']
-        ))
-        conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        return False # Already saved
-    finally:
-        conn.close()
+    return save_articles([article_data]) == 1 # False if already saved
 
 def get_saved_articles():
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query("SELECT * FROM saved_items ORDER BY saved_at DESC", conn)
-    conn.close()
-    return df
+    return pd.read_sql_query("SELECT * FROM saved_items ORDER BY saved_at DESC", get_connection())
+
+def get_saved_keys_among(keys):
+    """The subset of `keys` that are saved: one indexed lookup sized by the page, not the table."""
+    keys = list(keys)
+    if not keys:
+        return set()
+    placeholders = ",".join("?" * len(keys))
+    return {row[0] for row in get_connection().execute(
+        f"SELECT link_key FROM saved_items WHERE link_key IN ({placeholders})", keys)}
+
+def remove_saved_articles(links):
+    """Removes many saved items in one transaction. Returns how many were removed."""
+    with transaction() as conn:
+        return conn.executemany(
+            "DELETE FROM saved_items WHERE link_key = ?", [(link_key(link),) for link in links]
+        ).rowcount
 
 def remove_saved_article(link):
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("DELETE FROM saved_items WHERE link = ?", (link,))
-    conn.commit()
-    conn.close()
+    remove_saved_articles([link])
 
 def add_source(name, domain, category):
-    conn = sqlite3.connect(DB_PATH)
     try:
-        conn.execute("INSERT INTO sources (name, domain, category) VALUES (?, ?, ?)", (name, domain, category))
-        conn.commit()
+        with transaction() as conn:
+            conn.execute("INSERT INTO sources (name, domain, category) VALUES (?, ?, ?)", (name, domain, category))
         return True
     except sqlite3.IntegrityError:
         return False
-    finally:
-        conn.close()
 
 def get_sources():
-    conn = sqlite3.connect(DB_PATH)
-    df = pd.read_sql_query("SELECT * FROM sources", conn)
-    conn.close()
+    return pd.read_sql_query("SELECT * FROM sources", get_connection())
+
+def register_sources(sources_df):
+    """
+    Upserts sources.csv-style rows (name, region, strategy, query) into the sources
+    table, keyed by query. Existing polling state is kept.
+    """
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO sources (name, region, strategy, query)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(query) DO UPDATE SET
+                name = excluded.name, region = excluded.region, strategy = excluded.strategy
+        ''', [
+            (row['name'], row['region'], row['strategy'], row['query'])
+            for _, row in sources_df.iterrows()
+        ])
+
+# Custom sources added from the UI default to a Google News site: query
+SOURCE_FETCH_COLUMNS = '''
+    id, name, COALESCE(region, 'Global') AS region,
+    COALESCE(strategy, 'google_news') AS strategy,
+    COALESCE(query, 'site:' || domain) AS query,
+    poll_interval, next_poll
+'''
+
+def get_due_sources(now, limit=None):
+    """Sources whose next_poll time has passed (or that were never polled), most overdue first."""
+    df = pd.read_sql_query(f'''
+        SELECT {SOURCE_FETCH_COLUMNS}
+        FROM sources
+        WHERE next_poll IS NULL OR next_poll <= ?
+        ORDER BY COALESCE(next_poll, 0)
+        LIMIT ?
+    ''', get_connection(), params=(now, -1 if limit is None else limit))
     return df
 
+def get_next_poll_time():
+    """Earliest scheduled poll across all sources, or None if nothing is scheduled."""
+    row = get_connection().execute("SELECT MIN(COALESCE(next_poll, 0)) FROM sources").fetchone()
+    return row[0]
+
+def update_schedule(items):
+    """Stores (source_id, poll_interval, next_poll) tuples after a poll."""
+    with transaction() as conn:
+        conn.executemany(
+            "UPDATE sources SET poll_interval = ?, next_poll = ?, last_sync = CURRENT_TIMESTAMP WHERE id = ?",
+            [(interval, next_poll, source_id) for source_id, interval, next_poll in items]
+        )
+
+def get_publication_dates(firms, days=30):
+    """Returns {firm: [published dates]} for articles published in the last `days` days."""
+    firms = list(set(firms))
+    if not firms:
+        return {}
+    since = datetime.date.today() - datetime.timedelta(days=days)
+    placeholders = ",".join("?" * len(firms))
+    rows = get_connection().execute(
+        f"SELECT firm, published_date FROM articles WHERE firm IN ({placeholders}) AND published_date >= ?",
+        firms + [since.isoformat()]
+    ).fetchall()
+    dates = {}
+    for firm, published in rows:
+        dates.setdefault(firm, []).append(datetime.date.fromisoformat(str(published)[:10]))
+    return dates
+
+def get_seen_keys(keys, chunk=500):
+    """
+    Returns the subset of `keys` (links or GUIDs) already present in the articles table,
+    or archived from it. Links match on their canonical key, so tracking-parameter
+    variants count as seen.
+    """
+    keys = [k for k in set(keys) if k]
+    hashed = {k: link_key(k) for k in keys}
+    conn = get_connection()
+    found_links, found_guids = set(), set()
+    for start in range(0, len(keys), chunk):
+        part = keys[start:start + chunk]
+        placeholders = ",".join("?" * len(part))
+        rows = conn.execute(
+            f"SELECT link_key, guid FROM articles WHERE link_key IN ({placeholders}) OR guid IN ({placeholders})",
+            [hashed[k] for k in part] + part
+        ).fetchall()
+        found_links.update(r[0] for r in rows)
+        found_guids.update(r[1] for r in rows)
+        found_links.update(r[0] for r in conn.execute(
+            f"SELECT link_key FROM archived_keys WHERE link_key IN ({placeholders})", [hashed[k] for k in part]))
+    return {k for k in keys if hashed[k] in found_links or k in found_guids}
+
+ARTICLE_COLUMNS = ["url", "title", "firm", "published_date", "summary", "impact_score", "region", "topic", "guid"]
+
+def _existing_keys(conn, table, column, keys, chunk=500):
+    """Which of `keys` already exist in table.column, looked up in chunks."""
+    keys = list(keys)
+    found = set()
+    for i in range(0, len(keys), chunk):
+        part = keys[i:i + chunk]
+        placeholders = ",".join("?" * len(part))
+        found.update(r[0] for r in conn.execute(f"SELECT {column} FROM {table} WHERE {column} IN ({placeholders})", part))
+    return found
+
+def upsert_articles(articles, refresh=True, feed_cache=None):
+    """
+    Bulk-writes article rows (dicts with the articles column names) in one transaction.
+    Rows are matched on the canonical link key, so the same page under different
+    tracking parameters is one article. New links are inserted. With refresh=True,
+    existing links get their score, summary and topic updated when those changed.
+    Rows without a URL, repeats within the batch and unchanged rows count as skipped.
+    `feed_cache` (namespace, items as for save_feed_cache()) is written in the same
+    transaction, so feed validators are never committed without the articles behind them.
+    Returns {'inserted': n, 'updated': n, 'skipped': n, 'new_keys': link keys inserted}.
+    """
+    articles = list(articles)
+    batch = {}
+    for a in articles:
+        if a.get('url'):
+            key = link_key(a['url'])
+            batch[key] = {col: a.get(col) for col in ARTICLE_COLUMNS}
+            batch[key]["link_key"] = key
+    
+    if refresh:
+        conflict = '''
+            ON CONFLICT(link_key) DO UPDATE SET
+                impact_score = excluded.impact_score,
+                summary = excluded.summary,
+                topic = COALESCE(excluded.topic, articles.topic)
+            WHERE articles.impact_score IS NOT excluded.impact_score
+               OR articles.summary IS NOT excluded.summary
+               OR (excluded.topic IS NOT NULL AND articles.topic IS NOT excluded.topic)
+        '''
+    else:
+        conflict = "ON CONFLICT(link_key) DO NOTHING"
+    
+    with transaction() as conn:
+        existing = _existing_keys(conn, "articles", "link_key", batch)
+        changes = conn.executemany(f'''
+            INSERT INTO articles (url, link_key, title, firm, published_date, summary, impact_score, region, topic, guid, ingested_at)
+            VALUES (:url, :link_key, :title, :firm, :published_date, :summary, :impact_score, :region, :topic, :guid, CURRENT_TIMESTAMP)
+            {conflict}
+        ''', list(batch.values())).rowcount
+        if feed_cache:
+            _write_feed_cache(conn, *feed_cache)
+    
+    inserted = len(batch) - len(existing)
+    updated = changes - inserted
+    return {"inserted": inserted, "updated": updated, "skipped": len(articles) - inserted - updated,
+            "new_keys": set(batch) - existing}
+
+# --- QUERY API ---
+DASHBOARD_COLUMNS = '''
+    articles.firm AS Firm, articles.region AS Region, COALESCE(articles.topic, 'Others') AS Topic,
+    articles.title AS Headline, articles.impact_score AS Impact, articles.published_date AS Date,
+    articles.url AS Link
+'''
+# Sort keys for keyset pagination; each ends in the unique link_key so the order is total
+ARTICLE_ORDERS = {
+    "impact": ("impact_score", "published_date", "link_key"),
+    "date": ("published_date", "impact_score", "link_key"),
+}
+
+def article_filters(region=None, topic=None, firm=None, start=None, end=None, min_impact=None):
+    """WHERE terms and parameters for the Dashboard filters on articles."""
+    where, params = [], []
+    for column, value in (("region", region), ("topic", topic), ("firm", firm)):
+        if value is not None:
+            # Untagged legacy rows are shown as 'Others'
+            where.append("COALESCE(articles.topic, 'Others') = ?" if (column, value) == ("topic", "Others") else f"articles.{column} = ?")
+            params.append(value)
+    if start is not None:
+        where.append("articles.published_date >= ?")
+        params.append(str(start))
+    if end is not None:
+        where.append("articles.published_date <= ?")
+        params.append(str(end))
+    if min_impact is not None:
+        where.append("articles.impact_score >= ?")
+        params.append(min_impact)
+    return where, params
+
+def query_articles(region=None, topic=None, firm=None, start=None, end=None, min_impact=None,
+                   order="impact", after=None, limit=50):
+    """
+    Filtered, sorted page of articles in the Dashboard's column layout.
+    Filtering, sorting and paging all run in SQL on indexed columns; `after` is the
+    cursor returned with the previous page, so deep pages cost the same as the first.
+    Returns (DataFrame, next cursor or None when this is the last page).
+    """
+    keys = ARTICLE_ORDERS[order]
+    where, params = article_filters(region, topic, firm, start, end, min_impact)
+    if after is not None:
+        where.append(f"({', '.join(keys)}) < ({', '.join('?' * len(keys))})")
+        params.extend(after)
+    
+    sql = f"SELECT {DASHBOARD_COLUMNS}, {', '.join(keys)} FROM articles"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY " + ", ".join(f"{k} DESC" for k in keys)
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    
+    cursor = get_connection().execute(sql, params)
+    names = [d[0] for d in cursor.description]
+    rows = cursor.fetchall()
+    next_cursor = tuple(rows[-1][-len(keys):]) if limit is not None and len(rows) == limit else None
+    
+    df = pd.DataFrame([r[:-len(keys)] for r in rows], columns=names[:-len(keys)])
+    if not df.empty:
+        df["Date"] = pd.to_datetime(df["Date"], errors="coerce").dt.date
+    return df, next_cursor
+
+def iter_articles(region=None, topic=None, text=None, chunk_size=5000):
+    """
+    Every article matching the Dashboard filters (and full-text `text`, if any), in
+    Dashboard columns and order, as (column names, list of row tuples) chunks of up to
+    chunk_size rows. Memory stays bounded whatever the size of the result.
+    """
+    where, params = article_filters(region, topic)
+    query = build_fts_query(text) if text else None
+    if text and not query:
+        return
+    if query:
+        sql = f"SELECT {DASHBOARD_COLUMNS} FROM articles_fts JOIN articles ON articles.rowid = articles_fts.rowid"
+        where.insert(0, "articles_fts MATCH ?")
+        params.insert(0, query)
+        order = f"bm25(articles_fts, {ARTICLE_SEARCH_WEIGHTS})"
+    else:
+        sql = f"SELECT {DASHBOARD_COLUMNS} FROM articles"
+        order = ", ".join(f"{k} DESC" for k in ARTICLE_ORDERS["impact"])
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    cursor = get_connection().execute(f"{sql} ORDER BY {order}", params)
+    names = [d[0] for d in cursor.description]
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield names, rows
+
+def get_data_version(name="articles"):
+    """Counter bumped on every insert, update and delete of the table."""
+    row = get_connection().execute("SELECT version FROM data_versions WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+def get_filter_options():
+    """Distinct regions and topics present in the store, for the Dashboard filters."""
+    conn = get_connection()
+    regions = [r[0] for r in conn.execute("SELECT DISTINCT region FROM articles WHERE region IS NOT NULL ORDER BY region")]
+    topics = [r[0] for r in conn.execute("SELECT DISTINCT COALESCE(topic, 'Others') FROM articles ORDER BY 1")]
+    return regions, topics
+
+def query_saved(after=None, limit=50):
+    """Page of saved items, newest first. Returns (DataFrame, next cursor or None)."""
+    sql = "SELECT * FROM saved_items"
+    params = []
+    if after is not None:
+        sql += " WHERE (saved_at, id) < (?, ?)"
+        params.extend(after)
+    sql += " ORDER BY saved_at DESC, id DESC LIMIT ?"
+    params.append(limit)
+    df = pd.read_sql_query(sql, get_connection(), params=params)
+    next_cursor = (df["saved_at"].iloc[-1], int(df["id"].iloc[-1])) if len(df) == limit else None
+    return df, next_cursor
+
+# --- NEAR-DUPLICATE FINGERPRINTS ---
+def get_fingerprint_candidates(band_sets, chunk=200):
+    """
+    Stored (link key, simhash) pairs that share at least one band with any of the
+    given band tuples (band0, band1, band2, band3). Each band lookup is indexed.
+    """
+    band_sets = list(band_sets)
+    conn = get_connection()
+    found = {}
+    for position in range(4):
+        values = list({b[position] for b in band_sets})
+        for i in range(0, len(values), chunk):
+            part = values[i:i + chunk]
+            placeholders = ",".join("?" * len(part))
+            for key, fp in conn.execute(
+                f"SELECT link_key, simhash FROM fingerprints WHERE band{position} IN ({placeholders})", part
+            ):
+                found[key] = fp
+    return list(found.items())
+
+def save_fingerprints(items):
+    """Stores (link key, signed simhash, (band0..band3)) tuples."""
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT OR REPLACE INTO fingerprints (link_key, simhash, band0, band1, band2, band3)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', [(key, fp, *b) for key, fp, b in items])
+
+# --- FULL-TEXT SEARCH ---
+# bm25 column weights: a hit in the headline counts most, then the firm name
+ARTICLE_SEARCH_WEIGHTS = "10.0, 1.0, 5.0, 2.0"   # title, summary, firm, topic
+SAVED_SEARCH_WEIGHTS = "10.0, 5.0, 2.0"          # headline, firm, topic
+
+def build_fts_query(text):
+    """
+    Turns search-box input into a safe FTS5 query. Words are ANDed together,
+    "quoted text" is a phrase and a trailing * makes a prefix query (e.g. decarbon*).
+    Everything else is quoted, so FTS5 operators in user input can't cause syntax errors.
+    """
+    terms = []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        if phrase.strip():
+            terms.append('"' + phrase.strip() + '"')
+        elif word:
+            prefix = word.endswith("*")
+            word = word.rstrip("*").replace('"', "")
+            if re.search(r"\w", word): # pure punctuation would never match
+                terms.append('"' + word + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+def search_articles(text, region=None, topic=None, limit=50):
+    """
+    Ranked (bm25) full-text search over stored articles, optionally within the
+    Dashboard filters. Returns the Dashboard columns plus a highlighted Snippet.
+    """
+    query = build_fts_query(text)
+    if not query:
+        return pd.DataFrame()
+    sql = f'''
+        SELECT {DASHBOARD_COLUMNS},
+               snippet(articles_fts, -1, '<mark>', '</mark>', '…', 16) AS Snippet
+        FROM articles_fts JOIN articles ON articles.rowid = articles_fts.rowid
+        WHERE articles_fts MATCH ?
+    '''
+    params = [query]
+    if region is not None:
+        sql += " AND articles.region = ?"
+        params.append(region)
+    if topic is not None:
+        sql += " AND COALESCE(articles.topic, 'Others') = ?"
+        params.append(topic)
+    sql += f" ORDER BY bm25(articles_fts, {ARTICLE_SEARCH_WEIGHTS}) LIMIT ?"
+    params.append(limit)
+    df = pd.read_sql_query(sql, get_connection(), params=params)
+    if not df.empty:
+        df["Date"] = pd.to_datetime(df["Date"], errors="coerce").dt.date
+    return df
+
+def search_saved(text, limit=50):
+    """Ranked full-text search over saved items; saved_items columns plus a Snippet."""
+    query = build_fts_query(text)
+    if not query:
+        return pd.DataFrame()
+    return pd.read_sql_query(f'''
+        SELECT saved_items.*, snippet(saved_fts, -1, '<mark>', '</mark>', '…', 16) AS snippet
+        FROM saved_fts JOIN saved_items ON saved_items.id = saved_fts.rowid
+        WHERE saved_fts MATCH ?
+        ORDER BY bm25(saved_fts, {SAVED_SEARCH_WEIGHTS})
+        LIMIT ?
+    ''', get_connection(), params=(query, limit))
+
+def _encode_value(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return {"__date__": value.isoformat()}
+    raise TypeError(f"Cannot cache value of type {type(value).__name__}")
+
+def _decode_value(obj):
+    if "__date__" in obj:
+        value = obj["__date__"]
+        return datetime.datetime.fromisoformat(value) if "T" in value else datetime.date.fromisoformat(value)
+    return obj
+
+def get_feed_cache(namespace, urls):
+    """Returns {url: {'etag', 'last_modified', 'entries'}} for the cached feeds among urls."""
+    urls = list(urls)
+    if not urls:
+        return {}
+    placeholders = ",".join("?" * len(urls))
+    rows = get_connection().execute(
+        f"SELECT url, etag, last_modified, entries FROM feed_cache WHERE namespace = ? AND url IN ({placeholders})",
+        [namespace] + urls
+    ).fetchall()
+    return {
+        url: {
+            "etag": etag,
+            "last_modified": last_modified,
+            "entries": json.loads(entries, object_hook=_decode_value) if entries else []
+        }
+        for url, etag, last_modified, entries in rows
+    }
+
+def save_feed_cache(namespace, items):
+    """Stores (url, etag, last_modified, entries) tuples, replacing any previous state."""
+    with transaction() as conn:
+        _write_feed_cache(conn, namespace, items)
+
+def _write_feed_cache(conn, namespace, items):
+    conn.executemany('''
+        INSERT OR REPLACE INTO feed_cache (namespace, url, etag, last_modified, entries, last_sync)
+        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', [
+        (namespace, url, etag, last_modified, json.dumps(entries, default=_encode_value))
+        for url, etag, last_modified, entries in items
+    ])
+
+FEED_STATE_COLUMNS = ["url", "failures", "empty_syncs", "trips", "open_until", "reason", "last_error"]
+
+def get_feed_states(urls):
+    """Returns {url: breaker state dict} for the feeds among urls that have one."""
+    urls = list(urls)
+    if not urls:
+        return {}
+    placeholders = ",".join("?" * len(urls))
+    cursor = get_connection().execute(
+        f"SELECT {', '.join(FEED_STATE_COLUMNS)} FROM feed_state WHERE url IN ({placeholders})", urls)
+    return {row[0]: dict(zip(FEED_STATE_COLUMNS, row)) for row in cursor}
+
+def save_feed_states(states):
+    """Upserts breaker state dicts (FEED_STATE_COLUMNS keys)."""
+    if not states:
+        return
+    with transaction() as conn:
+        conn.executemany(f'''
+            INSERT OR REPLACE INTO feed_state ({', '.join(FEED_STATE_COLUMNS)}, updated_at)
+            VALUES ({', '.join(':' + c for c in FEED_STATE_COLUMNS)}, CURRENT_TIMESTAMP)
+        ''', [{c: s.get(c) for c in FEED_STATE_COLUMNS} for s in states])
+
+def get_open_breakers():
+    """Sources currently skipped by their circuit breaker, soonest to retry first."""
+    return pd.read_sql_query('''
+        SELECT url, reason, trips, datetime(open_until, 'unixepoch', 'localtime') AS retry_after, last_error
+        FROM feed_state WHERE open_until > strftime('%s', 'now')
+        ORDER BY open_until
+    ''', get_connection())
+
+def record_snapshots(items):
+    """Indexes (url, digest, size) tuples as fetched now."""
+    with transaction() as conn:
+        conn.executemany("INSERT INTO snapshots (url, digest, size) VALUES (?, ?, ?)", items)
+
+def get_snapshot_digests():
+    """(digest, last fetched_at) of every indexed body, least recently fetched first."""
+    return get_connection().execute(
+        "SELECT digest, MAX(fetched_at) AS last FROM snapshots GROUP BY digest ORDER BY last"
+    ).fetchall()
+
+def delete_snapshots(before=None, digests=None):
+    """Removes index rows fetched before `before` and/or of the given digests. Returns the count."""
+    removed = 0
+    with transaction() as conn:
+        if before is not None:
+            removed += conn.execute("DELETE FROM snapshots WHERE fetched_at < ?", (str(before),)).rowcount
+        digests = list(digests or ())
+        for i in range(0, len(digests), 500):
+            part = digests[i:i + 500]
+            removed += conn.execute(
+                f"DELETE FROM snapshots WHERE digest IN ({','.join('?' * len(part))})", part).rowcount
+    return removed
+
+def get_snapshots(urls=None, since=None, until=None):
+    """
+    (url, digest, fetched_at) of the snapshots taken in [since, until), oldest first,
+    optionally only for the given urls. Bounds are compared as UTC timestamp strings.
+    """
+    where, params = [], []
+    if urls is not None:
+        urls = list(urls)
+        where.append(f"url IN ({','.join('?' * len(urls))})")
+        params.extend(urls)
+    if since is not None:
+        where.append("fetched_at >= ?")
+        params.append(str(since))
+    if until is not None:
+        where.append("fetched_at < ?")
+        params.append(str(until))
+    sql = "SELECT url, digest, fetched_at FROM snapshots"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    return get_connection().execute(sql + " ORDER BY fetched_at, id", params).fetchall()
+
+# --- METRICS ---
+METRICS_RETENTION_DAYS = 14
+
+def save_metrics(run_id, pipeline, sources, stages):
+    """
+    Stores one run's per-source records (dicts) and {stage: (seconds, calls)},
+    and drops metrics older than METRICS_RETENTION_DAYS.
+    """
+    cutoff = f"-{METRICS_RETENTION_DAYS} days"
+    with transaction() as conn:
+        conn.executemany('''
+            INSERT INTO source_metrics (run_id, pipeline, source, url, status, latency_ms, bytes, entries, kept, filtered, error)
+            VALUES (:run_id, :pipeline, :source, :url, :status, :latency_ms, :bytes, :entries, :kept, :filtered, :error)
+        ''', [dict(s, run_id=run_id, pipeline=pipeline) for s in sources])
+        conn.executemany(
+            "INSERT INTO stage_metrics (run_id, pipeline, stage, seconds, calls) VALUES (?, ?, ?, ?, ?)",
+            [(run_id, pipeline, stage, seconds, calls) for stage, (seconds, calls) in stages.items()]
+        )
+        conn.execute("DELETE FROM source_metrics WHERE recorded_at < datetime('now', ?)", (cutoff,))
+        conn.execute("DELETE FROM stage_metrics WHERE recorded_at < datetime('now', ?)", (cutoff,))
+
+def get_source_health():
+    """
+    One row per source URL: its latest fetch, plus fetch count, error ratio and
+    average latency over the retention window. Failing sources sort first.
+    """
+    return pd.read_sql_query('''
+        WITH stats AS (
+            SELECT url, MAX(id) AS last_id, COUNT(*) AS fetches,
+                   AVG(error IS NOT NULL) AS error_ratio, AVG(latency_ms) AS avg_latency_ms
+            FROM source_metrics GROUP BY url
+        )
+        SELECT m.source, m.url, m.pipeline, m.status, m.latency_ms, m.bytes, m.entries, m.kept, m.filtered,
+               m.error AS last_error, m.recorded_at AS last_fetch,
+               s.fetches, s.error_ratio, s.avg_latency_ms
+        FROM stats s JOIN source_metrics m ON m.id = s.last_id
+        ORDER BY m.error IS NULL, s.error_ratio DESC, m.latency_ms DESC
+    ''', get_connection())
+
+def get_stage_metrics():
+    """Stage timings of the latest run of each pipeline."""
+    return pd.read_sql_query('''
+        SELECT pipeline, stage, seconds, calls, recorded_at FROM stage_metrics
+        WHERE run_id IN (SELECT run_id FROM stage_metrics WHERE id IN (SELECT MAX(id) FROM stage_metrics GROUP BY pipeline))
+        ORDER BY pipeline, seconds DESC
+    ''', get_connection())
+
+# --- ALERTS ---
+
+def add_alert_rule(name, query):
+    with transaction() as conn:
+        return conn.execute("INSERT INTO alert_rules (name, query) VALUES (?, ?)", (name, query)).lastrowid
+
+def delete_alert_rule(rule_id):
+    """Deletes a rule and (by trigger) its alerts."""
+    with transaction() as conn:
+        conn.execute("DELETE FROM alert_rules WHERE id = ?", (rule_id,))
+
+def set_alert_rule_active(rule_id, active):
+    with transaction() as conn:
+        conn.execute("UPDATE alert_rules SET active = ? WHERE id = ?", (int(bool(active)), rule_id))
+
+def get_alert_rules(active_only=False):
+    sql = '''
+        SELECT r.id, r.name, r.query, r.active, r.created_at,
+               (SELECT COUNT(*) FROM alerts a WHERE a.rule_id = r.id) AS hits
+        FROM alert_rules r
+    '''
+    if active_only:
+        sql += " WHERE r.active = 1"
+    return pd.read_sql_query(sql + " ORDER BY r.id", get_connection())
+
+def save_alerts(items):
+    """Stores (rule_id, link_key, url, title, firm, topic, impact, published_date) hits; repeats are ignored."""
+    with transaction() as conn:
+        return conn.executemany('''
+            INSERT OR IGNORE INTO alerts (rule_id, link_key, url, title, firm, topic, impact, published_date)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', items).rowcount
+
+def get_alerts(unseen_only=False, limit=200):
+    """Latest alerts first, with the name of the rule that raised them."""
+    sql = '''
+        SELECT a.id, r.name AS rule, a.title, a.firm, a.topic, a.impact, a.published_date, a.url, a.seen, a.created_at
+        FROM alerts a JOIN alert_rules r ON r.id = a.rule_id
+    '''
+    if unseen_only:
+        sql += " WHERE a.seen = 0"
+    return pd.read_sql_query(sql + " ORDER BY a.id DESC LIMIT ?", get_connection(), params=(limit,))
+
+def count_unseen_alerts():
+    return get_connection().execute("SELECT COUNT(*) FROM alerts WHERE seen = 0").fetchone()[0]
+
+def mark_alerts_seen():
+    with transaction() as conn:
+        return conn.execute("UPDATE alerts SET seen = 1 WHERE seen = 0").rowcount
+
+# --- FETCH QUEUE ---
+# Several aggregator processes (on one host or on hosts sharing the volume) work through
+# one round of sources together. Claims are leases: a source whose worker died becomes
+# claimable again once its lease expires. Every claim runs in an IMMEDIATE transaction,
+# so two workers never hold the same source at once.
+
+def open_round(round_id=None):
+    """
+    Joins the round that still has unfinished sources, or starts a new one over every
+    row of the sources table. A named round is joined if it exists (finished or not)
+    and created otherwise. Returns the round id.
+    """
+    with transaction() as conn:
+        if round_id is None:
+            row = conn.execute("SELECT round_id FROM fetch_queue WHERE done_at IS NULL LIMIT 1").fetchone()
+            if row:
+                return row[0]
+            round_id = uuid.uuid4().hex[:12]
+        elif conn.execute("SELECT 1 FROM fetch_queue WHERE round_id = ? LIMIT 1", (round_id,)).fetchone():
+            return round_id
+        # Finished rounds are no longer needed
+        conn.execute("DELETE FROM fetch_queue WHERE round_id NOT IN (SELECT round_id FROM fetch_queue WHERE done_at IS NULL)")
+        conn.execute("INSERT INTO fetch_queue (round_id, source_id) SELECT ?, id FROM sources", (round_id,))
+    return round_id
+
+def claim_sources(round_id, worker, limit, lease_seconds, shard=None, shards=1, max_attempts=3):
+    """
+    Leases up to `limit` open sources of the round to `worker` and returns them like
+    get_due_sources(). With a shard, sources whose id falls in it (id % shards) come
+    first; once those are all taken the worker steals from the other shards, from the
+    far end so it rarely contends with their owners. Sources whose lease has expired
+    `max_attempts` times are given up on, so one feed can't stall the round.
+    """
+    now = time.time()
+    claimable = "round_id = ? AND done_at IS NULL AND (lease_expires IS NULL OR lease_expires < ?)"
+    with transaction() as conn:
+        conn.execute(f"UPDATE fetch_queue SET done_at = ? WHERE {claimable} AND attempts >= ?",
+                     (now, round_id, now, max_attempts))
+        ids = []
+        if shard is not None:
+            ids = [row[0] for row in conn.execute(
+                f"SELECT source_id FROM fetch_queue WHERE {claimable} AND source_id % ? = ? ORDER BY source_id LIMIT ?",
+                (round_id, now, shards, shard, limit))]
+        if not ids:
+            ids = [row[0] for row in conn.execute(
+                f"SELECT source_id FROM fetch_queue WHERE {claimable} ORDER BY source_id {'DESC' if shard is not None else ''} LIMIT ?",
+                (round_id, now, limit))]
+        if not ids:
+            return pd.DataFrame()
+        placeholders = ",".join("?" * len(ids))
+        conn.execute(f'''
+            UPDATE fetch_queue SET owner = ?, lease_expires = ?, attempts = attempts + 1
+            WHERE round_id = ? AND source_id IN ({placeholders})
+        ''', [worker, now + lease_seconds, round_id] + ids)
+        return pd.read_sql_query(f"SELECT {SOURCE_FETCH_COLUMNS} FROM sources WHERE id IN ({placeholders}) ORDER BY id",
+                                 conn, params=ids)
+
+def complete_sources(round_id, worker, source_ids):
+    """
+    Marks sources done, but only those `worker` still holds: if its lease expired and
+    another worker took over, that worker finishes them. Returns how many were marked.
+    """
+    source_ids = list(source_ids)
+    if not source_ids:
+        return 0
+    placeholders = ",".join("?" * len(source_ids))
+    with transaction() as conn:
+        return conn.execute(f'''
+            UPDATE fetch_queue SET done_at = ?, lease_expires = NULL
+            WHERE round_id = ? AND owner = ? AND done_at IS NULL AND source_id IN ({placeholders})
+        ''', [time.time(), round_id, worker] + source_ids).rowcount
+
+def get_round_status(round_id):
+    """Counts of the round's sources: {'open', 'leased', 'done'} (leased ones are also open)."""
+    row = get_connection().execute('''
+        SELECT COUNT(*) FILTER (WHERE done_at IS NULL),
+               COUNT(*) FILTER (WHERE done_at IS NULL AND lease_expires >= ?),
+               COUNT(*) FILTER (WHERE done_at IS NOT NULL)
+        FROM fetch_queue WHERE round_id = ?
+    ''', (time.time(), round_id)).fetchone()
+    return {"open": row[0], "leased": row[1], "done": row[2]}
+
 if __name__ == "__main__":
     init_db()
     print("Database initialized.")
@@ -0,0 +1,130 @@
+import hashlib
+import re
+
+import numpy as np
+
+from database import get_fingerprint_candidates, save_fingerprints
+from matcher import tokenize
+import urls
+
+# --- CONFIGURATION ---
+# 64-bit SimHash split into 4 bands of 16 bits. Two fingerprints within
+# MAX_DISTANCE (< BANDS) bits of each other must agree on at least one whole
+# band, so comparing only items that share a band bucket misses no near-duplicate.
+BANDS = 4
+BAND_BITS = 16
+MAX_DISTANCE = 3
+TITLE_WEIGHT = 3  # the headline matters more than the (outlet-specific) summary
+
+# Google News summaries end in <font>Outlet Name</font>; the outlet is not part of the story
+OUTLET_RE = re.compile(r"<font[^>]*>.*?</font>", re.I | re.S)
+TAG_RE = re.compile(r"<[^>]+>|&\w+;")
+STOPWORDS = {"a", "an", "and", "the", "of", "in", "on", "for", "to", "with", "by", "at", "from", "is", "are", "s"}
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def _features(title, summary):
+    """Unigrams and bigrams of the normalized text, with weights."""
+    features = {}
+    for text, weight in ((title, TITLE_WEIGHT), (summary, 1)):
+        words = [w for w in tokenize(TAG_RE.sub(" ", OUTLET_RE.sub(" ", text or ""))) if w not in STOPWORDS]
+        for gram in words + [a + " " + b for a, b in zip(words, words[1:])]:
+            features[gram] = features.get(gram, 0) + weight
+    return features
+
+
+def simhash(title, summary=""):
+    """64-bit SimHash of a headline and summary, as an unsigned int (0 for empty text)."""
+    features = _features(title, summary)
+    if not features:
+        return 0
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(f.encode(), digest_size=8).digest(), "big") for f in features],
+        dtype=np.uint64
+    )
+    weights = np.array(list(features.values()), dtype=np.int64)
+    bits = ((hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)).astype(np.int64)
+    votes = (weights[:, None] * (2 * bits - 1)).sum(axis=0)
+    return sum(1 << int(i) for i in np.flatnonzero(votes > 0))  # Python ints: numpy's int64 would go negative at bit 63
+
+
+def bands(fp):
+    return [(fp >> (BAND_BITS * i)) & ((1 << BAND_BITS) - 1) for i in range(BANDS)]
+
+
+def to_signed(fp):
+    """SQLite integers are signed 64-bit."""
+    return fp - (1 << 64) if fp >= 1 << 63 else fp
+
+
+def to_unsigned(fp):
+    return fp + (1 << 64) if fp < 0 else fp
+
+
+class NearDuplicateIndex:
+    """
+    LSH bucket index over SimHash fingerprints. A lookup only compares against
+    items sharing a band, so the cost per item stays roughly constant as the index grows.
+    """
+
+    def __init__(self, max_distance=MAX_DISTANCE):
+        self.max_distance = max_distance
+        self._buckets = {}
+
+    def add(self, fp, key):
+        for i, value in enumerate(bands(fp)):
+            self._buckets.setdefault((i, value), []).append((fp, key))
+
+    def match(self, fp):
+        """Key of an indexed near-duplicate of fp, or None."""
+        if not fp:
+            return None
+        for i, value in enumerate(bands(fp)):
+            for other, key in self._buckets.get((i, value), ()):
+                if bin(fp ^ other).count("1") <= self.max_distance:
+                    return key
+        return None
+
+
+def fingerprint_rows(rows, title_key, summary_key):
+    return [simhash(row.get(title_key) or "", row.get(summary_key) or "") for row in rows]
+
+
+def collapse(rows, fingerprints, impact_key, link_key, index=None):
+    """
+    Keeps the highest-impact member of each near-duplicate cluster in rows (dicts),
+    given their fingerprints. `index` may be pre-loaded with fingerprints from earlier
+    runs, keyed by link key; rows matching those are dropped too. Returns (kept rows in
+    their original order, {link key: fingerprint} for the kept rows).
+    """
+    index = index or NearDuplicateIndex()
+    order = sorted(range(len(rows)), key=lambda i: -(rows[i].get(impact_key) or 0))
+    kept, kept_fps = set(), {}
+    for i in order:
+        link, fp = rows[i].get(link_key), fingerprints[i]
+        key = urls.link_key(link) if link else None
+        match = index.match(fp)
+        if match is not None and match != key:
+            continue
+        index.add(fp, key)
+        kept.add(i)
+        kept_fps[key] = fp
+    return [row for i, row in enumerate(rows) if i in kept], kept_fps
+
+
+def collapse_with_store(rows, title_key, summary_key, impact_key, link_key):
+    """
+    collapse() that also drops rows near-duplicating anything already stored.
+    Only stored fingerprints sharing an LSH band with the batch are loaded.
+    Save the returned fingerprints once the kept rows are written.
+    """
+    fingerprints = fingerprint_rows(rows, title_key, summary_key)
+    index = NearDuplicateIndex()
+    for key, fp in get_fingerprint_candidates([bands(fp) for fp in fingerprints if fp]):
+        index.add(to_unsigned(fp), key)
+    return collapse(rows, fingerprints, impact_key, link_key, index)
+
+
+def remember(fingerprints):
+    """Persists {link key: fingerprint} so later runs can match against these items."""
+    save_fingerprints([(key, to_signed(fp), bands(fp)) for key, fp in fingerprints.items() if key is not None and fp])
@@ -1,8 +1,19 @@
-import feedparser
 import pandas as pd
 import datetime
 import time
 import re
+import os
+from functools import partial
+from fetcher import fetch_cached, cache_entries, DEFAULT_WORKERS, PARSE_WORKERS
+from feedstream import parse_stream
+import snapshots
+import metrics
+from matcher import KeywordMatcher, load_rules
+from database import get_seen_keys, upsert_articles
+import dedup
+import alerts
+from urls import link_key
+from blocklist import DomainBlocklist
 
 # --- CONFIGURATION (The Signal Cleaning Kit) ---
 BLACKLISTED_DOMAINS = [
@@ -11,50 +22,114 @@ BLACKLISTED_DOMAINS = [
     "collinsdictionary.com", "britannica.com", "wiktionary.org",
     "microsoft.com/en-us/account"
 ]
+# Extra rules (domains, "label." prefixes, domain/path, hosts-file or ||domain^ lines), loaded when present
+BLOCKLIST_FILE = os.environ.get("KB_BLOCKLIST", "blocklist.txt")
+MAX_ENTRIES = 10  # usable entries kept per feed; the rest of the document is not parsed
+NOISE_FLOOR = 20  # impact below this is treated as noise
 
 TOPIC_MAP = {
     "AI & Tech": ["ai", "generative ai", "llm", "automation", "digital", "technology", "quantum", "software", "data", "robotics"],
     "Macro & Economy": ["gdp", "inflation", "interest rates", "macro", "economy", "growth", "recession", "markets", "fiscal"],
     "ESG & Sustainability": ["esg", "climate", "carbon", "net zero", "sustainability", "energy", "green", "renewables", "decarbonization"],
     "Healthcare": ["biopharma", "clinical", "health", "patient", "medical", "biotech", "pharmaceutical", "life sciences"],
-    "Strategy & Ops": ["transformation", "supply chain", "operations", "strategic", "leadership", "ma", "merger", "procurement"],
+    "Strategy & Ops": ["transformation", "supply chain", "operations", "strategic", "leadership", "ma", "m&a", "merger", "procurement"],
     "Geopolitics & Policy": ["global", "trade", "policy", "government", "regulation", "international", "sanctions", "compliance"]
 }
 
 class ImpactScorer:
-    def __init__(self):
-        self.weights = {
+    def __init__(self, weights=None, noise=None, topic_map=None):
+        self.weights = weights or {
             "outlook": 25, "forecast": 25, "2026": 30, "2025": 20,
             "global": 15, "strategic": 20, "report": 20, "white paper": 30,
             "perspective": 10, "transformation": 15, "executive": 15
         }
         # Stronger noise detection - especially for dictionary/login patterns
-        self.noise = [
+        self.noise = noise or [
             "career", "hiring", "webinar", "register", "podcast", "account", 
             "sign in", "login", "meaning", "definition", "synonym", "pronunciation"
         ]
+        self.topic_map = topic_map or TOPIC_MAP
+        
+        # One whole-word matcher for weights, noise and topics: a single pass per headline
+        self.matcher = KeywordMatcher()
+        self.matcher.add_terms("weight", list(self.weights))
+        self.matcher.add_terms("noise", self.noise)
+        self.matcher.add_terms("topic", self.topic_map)
+
+    @classmethod
+    def from_config(cls, path):
+        """Builds a scorer from a JSON rules file with optional 'weights', 'noise' and 'topics' keys."""
+        rules = load_rules(path)
+        return cls(rules.get("weights"), rules.get("noise"), rules.get("topics"))
+    
+    def analyze(self, title, summary):
+        """Returns (impact score, topic) from one scan of the text."""
+        hits = self.matcher.match(title + " " + summary)
         
-    def score(self, title, summary):
         score = 40 # Base Score
-        text = (title + " " + summary).lower()
+        score += sum(self.weights[word] for word in hits.get("weight", ()))
+        score -= 60 * len(hits.get("noise", ())) # Aggressive penalty for noise
+        
+        return max(0, min(100, score)), pick_topic(hits.get("topic", ()), self.topic_map)
         
-        for word, weight in self.weights.items():
-            if word in text:
-                score += weight
+    def score(self, title, summary):
+        return self.analyze(title, summary)[0]
+    
+    def analyze_batch(self, titles, summaries):
+        """
+        Vectorized analyze() over whole columns.
+        Returns (impact scores, topics) as NumPy arrays aligned with the inputs.
+        """
+        titles = pd.Series(titles, dtype=object).reset_index(drop=True).fillna("").astype(str)
+        summaries = pd.Series(summaries, dtype=object).reset_index(drop=True).fillna("").astype(str)
+        texts = titles + " " + summaries
+        hits = self.matcher.match_frame(texts)
+        rows = pd.RangeIndex(len(texts))
+        
+        weights = hits[hits["group"] == "weight"]
+        boost = weights["label"].map(self.weights).groupby(weights["row"]).sum().reindex(rows, fill_value=0)
+        noise = hits[hits["group"] == "noise"].groupby("row").size().reindex(rows, fill_value=0)
+        scores = (40 + boost - 60 * noise).clip(0, 100).astype(int)
         
-        for word in self.noise:
-            if word in text:
-                score -= 60 # Aggressive penalty for noise
-                
-        return max(0, min(100, score))
+        order = {topic: i for i, topic in enumerate(self.topic_map)}
+        names = list(self.topic_map)
+        topics = hits[hits["group"] == "topic"]
+        first = topics["label"].map(order).groupby(topics["row"]).min().reindex(rows)
+        topics = first.map(lambda i: names[int(i)], na_action="ignore").fillna("Others")
+        
+        return scores.to_numpy(), topics.to_numpy(dtype=object)
 
-def classify_topic(title, summary):
-    text = (title + " " + summary).lower()
-    for topic, keywords in TOPIC_MAP.items():
-        if any(kw in text for kw in keywords):
+def pick_topic(matched, topic_map=TOPIC_MAP):
+    """First topic, in topic_map order, among the matched ones."""
+    for topic in topic_map:
+        if topic in matched:
             return topic
     return "Others"
 
+blocklist = DomainBlocklist(BLACKLISTED_DOMAINS)
+if os.path.exists(BLOCKLIST_FILE):
+    blocklist.load(BLOCKLIST_FILE)
+
+_topic_matcher = KeywordMatcher()
+_topic_matcher.add_terms("topic", TOPIC_MAP)
+
+def classify_topic(title, summary):
+    hits = _topic_matcher.match(title + " " + summary)
+    return pick_topic(hits.get("topic", ()))
+
+def score_frame(df, scorer=None, title_col="Headline", summary_col=None):
+    """
+    Rescores a DataFrame in bulk, e.g. after a weights change, without refetching.
+    Returns a copy with fresh 'Impact' and 'Topic' columns.
+    """
+    scorer = scorer or ImpactScorer()
+    summaries = df[summary_col] if summary_col else pd.Series("", index=df.index)
+    impact, topics = scorer.analyze_batch(df[title_col], summaries)
+    out = df.copy()
+    out["Impact"] = impact
+    out["Topic"] = topics
+    return out
+
 def get_rss_url(strategy, query):
     if strategy == "google_news":
         return f"https://news.google.com/rss/search?q={query}+when:30d&hl=en-US&gl=US&ceid=US:en"
@@ -62,49 +137,179 @@ def get_rss_url(strategy, query):
         return f"https://www.bing.com/search?q={query}&format=rss"
     return query
 
-def fetch_and_rank(sources_df):
+def clean_entry(entry):
+    """Headline without Google's " - Outlet" suffix, and the summary without bold tags."""
+    title = entry.get('title', 'No Title').rsplit(' - ', 1)[0]
+    summary = entry.get('summary', '').replace('<b>', '').replace('</b>', '').strip()
+    return title, summary
+
+def analyze_entry(entry, scorer):
+    """
+    (impact, topic) of a feed entry. Kept on the entry, so the streaming filter
+    and rank_entries() score each entry once between them.
+    """
+    analysis = entry.get('_analysis')
+    if analysis is None:
+        with metrics.stage("score"):
+            analysis = scorer.analyze(*clean_entry(entry))
+        entry['_analysis'] = analysis
+    return analysis
+
+def is_usable(entry, scorer):
+    """Blacklist and noise filters, checked while the feed is still streaming in."""
+    if blocklist.blocks(entry.get('link', '')):
+        return False
+    return analyze_entry(entry, scorer)[0] >= NOISE_FLOOR
+
+def rank_entries(feed, row, scorer, seen=()):
+    """
+    Filters, scores and tags the top MAX_ENTRIES usable entries of one parsed feed.
+    Entries whose link or GUID is in `seen` are skipped before any scoring.
+    """
+    results = []
+    for entry in feed.entries:
+        if len(results) >= MAX_ENTRIES:
+            break
+        link = entry.get('link', '')
+        if link in seen or entry.get('id') in seen:
+            continue
+        
+        # NOISE FILTER 1: Domain Blacklist
+        if blocklist.blocks(link):
+            continue
+        
+        title, summary = clean_entry(entry)
+        
+        # NOISE FILTER 2: Keyword-based Score Check (one matcher pass scores and classifies,
+        # already done by is_usable() when the feed was streamed)
+        impact, topic = analyze_entry(entry, scorer)
+        if impact < NOISE_FLOOR: # Drop high-probability noise early
+            continue
+        
+        published = entry.get('published_parsed') or entry.get('updated_parsed')
+        pub_date = datetime.datetime.fromtimestamp(time.mktime(published)).date() if published else datetime.date.today()
+        
+        results.append({
+            "Firm": row['name'],
+            "Region": row['region'],
+            "Topic": topic,
+            "Headline": title,
+            "Impact": impact,
+            "Date": pub_date,
+            "Link": link,
+            "Summary": summary,
+            "GUID": entry.get('id')
+        })
+    return results
+
+def to_article(row):
+    """A rank_entries() row as an articles table record (the shape upsert_articles() takes)."""
+    return {
+        'url': row['Link'],
+        'title': row['Headline'],
+        'firm': row['Firm'],
+        'published_date': row['Date'],
+        'summary': row['Summary'],
+        'impact_score': row['Impact'],
+        'region': row['Region'],
+        'topic': row['Topic'],
+        'guid': row['GUID']
+    }
+
+def rank_body(scorer, source, body):
+    """
+    Parse-pool task: parses one raw feed body of `source` (a source row dict) and ranks it.
+    Module-level so that partial(rank_body, scorer) pickles.
+    Returns (rows, entries parsed).
+    """
+    feed = parse_stream([body], MAX_ENTRIES, lambda entry: is_usable(entry, scorer))
+    return rank_entries(feed, source, scorer), len(feed.entries)
+
+@metrics.track("engine")
+def fetch_and_rank(sources_df, workers=DEFAULT_WORKERS, replay=False, since=None, until=None, parse_workers=PARSE_WORKERS):
+    """
+    Ranked DataFrame of the best recent items across all sources.
+    With `replay` the feeds are read from the snapshots taken between since and
+    until (dates or datetimes, UTC) instead of the network. parse_workers > 1 moves
+    parsing and scoring to that many processes.
+    """
     scorer = ImpactScorer()
     all_results = []
     
-    for _, row in sources_df.iterrows():
-        url = get_rss_url(row['strategy'], row['query'])
-        try:
-            feed = feedparser.parse(url)
-            for entry in feed.entries[:10]:
-                link = entry.get('link', '')
-                
-                # NOISE FILTER 1: Domain Blacklist
-                if any(domain in link.lower() for domain in BLACKLISTED_DOMAINS):
-                    continue
-                
-                title = entry.get('title', 'No Title').rsplit(' - ', 1)[0]
-                summary = entry.get('summary', '').replace('<b>', '').replace('</b>', '').strip()
-                
-                # NOISE FILTER 2: Keyword-based Score Check
-                impact = scorer.score(title, summary)
-                if impact < 20: # Drop high-probability noise early
-                    continue
-                
-                published = entry.get('published_parsed')
-                pub_date = datetime.datetime.fromtimestamp(time.mktime(published)).date() if published else datetime.date.today()
-                
-                topic = classify_topic(title, summary)
-                
-                all_results.append({
-                    "Firm": row['name'],
-                    "Region": row['region'],
-                    "Topic": topic,
-                    "Headline": title,
-                    "Impact": impact,
-                    "Date": pub_date,
-                    "Link": link
-                })
-        except Exception:
-            continue
+    rows = [row for _, row in sources_df.iterrows()]
+    urls = [get_rss_url(row['strategy'], row['query']) for row in rows]
+    
+    # Feeds answering 304 Not Modified reuse their rows from the previous sync
+    # Each feed is parsed only until it has yielded MAX_ENTRIES usable entries
+    process = lambda i, feed: rank_entries(feed, rows[i], scorer)
+    accept = lambda entry: is_usable(entry, scorer)
+    with metrics.stage("fetch"):
+        if replay:
+            results = snapshots.replay(urls, process, since, until, MAX_ENTRIES, accept)
+        else:
+            results = fetch_cached(urls, process, "engine", workers=workers, max_entries=MAX_ENTRIES, accept=accept,
+                                   task=partial(rank_body, scorer), task_args=[row.to_dict() for row in rows],
+                                   parse_workers=parse_workers)
+    metrics.current().record_fetches([rows[r.get('i', i)]['name'] for i, r in enumerate(results)], results)
+    for result in results:
+        all_results.extend(result['rows'])
+    
+    # Same story syndicated under different URLs: keep the highest-impact copy
+    with metrics.stage("dedup"):
+        fingerprints = dedup.fingerprint_rows(all_results, "Headline", "Summary")
+        all_results, _ = dedup.collapse(all_results, fingerprints, "Impact", "Link")
             
     df = pd.DataFrame(all_results)
     if not df.empty:
         # Final Signal-to-Noise: Drop duplicates and sort
         df = df.sort_values(by=["Impact", "Date"], ascending=False)
-        df = df.drop_duplicates(subset=["Link"])
+        df["LinkKey"] = df["Link"].map(link_key) # canonical: ignores tracking params
+        df = df.drop_duplicates(subset=["LinkKey"])
+        df = df.drop(columns=["Summary", "GUID", "LinkKey"])
     return df
+
+@metrics.track("ingest")
+def ingest(sources_df, workers=DEFAULT_WORKERS, parse_workers=PARSE_WORKERS):
+    """
+    Incremental sync into the articles table. Only entries whose link or GUID
+    has not been stored before are scored and written; unchanged feeds (304)
+    are skipped outright. Returns the number of new articles stored.
+    """
+    scorer = ImpactScorer()
+    rows = [row for _, row in sources_df.iterrows()]
+    urls = [get_rss_url(row['strategy'], row['query']) for row in rows]
+    
+    def process(i, feed):
+        entries = feed.entries
+        with metrics.stage("db"):
+            seen = get_seen_keys([e.get('link') for e in entries] + [e.get('id') for e in entries])
+        return rank_entries(feed, rows[i], scorer, seen)
+    
+    new_rows = {}
+    with metrics.stage("fetch"):
+        results = fetch_cached(urls, process, "ingest", workers=workers,
+                               max_entries=MAX_ENTRIES, accept=lambda entry: is_usable(entry, scorer),
+                               task=partial(rank_body, scorer), task_args=[row.to_dict() for row in rows],
+                               parse_workers=parse_workers, save_cache=False)
+    metrics.current().record_fetches([row['name'] for row in rows], results)
+    candidates = [r for result in results if not result['error'] and result['status'] != 304 for r in result['rows']]
+    
+    # Pool workers can't check the store, so seen entries are dropped here (in-process rows were pre-filtered)
+    with metrics.stage("db"):
+        seen = get_seen_keys([r['Link'] for r in candidates] + [r['GUID'] for r in candidates])
+    for r in candidates:
+        if r['Link'] not in seen and r['GUID'] not in seen:
+            new_rows.setdefault(link_key(r['Link']), r)
+    
+    # Drop near-duplicates within the batch and of anything stored on earlier runs
+    with metrics.stage("dedup"):
+        kept, fingerprints = dedup.collapse_with_store(list(new_rows.values()), "Headline", "Summary", "Impact", "Link")
+    
+    articles = [to_article(r) for r in kept]
+    # Validators are committed with the articles, so a crash before this refetches the feeds
+    with metrics.stage("db"):
+        counts = upsert_articles(articles, feed_cache=("ingest", cache_entries(results)))
+        dedup.remember(fingerprints)
+    with metrics.stage("alerts"):
+        alerts.check_articles(articles, counts['new_keys'])
+    return counts['inserted']
@@ -0,0 +1,153 @@
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+
+from database import DB_PATH, init_db, get_data_version
+from retention import iter_all_articles
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = pq = None
+try:
+    import zstandard
+except ImportError:  # so is zstd for CSV
+    zstandard = None
+
+# --- CONFIGURATION ---
+# Built files, named by a hash of format, filters and the articles data version:
+# the same export asked for twice before the data changes is built once.
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "exports")
+EXPORT_CHUNK = 5000       # rows read and written per step; bounds memory for any export size
+EXPORT_CACHE_FILES = 20   # most recently used files kept
+ZSTD_LEVEL = 3
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "gzip": ".gz", "zstd": ".zst"}
+MIME_TYPES = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet",
+              "gzip": "application/gzip", "zstd": "application/zstd"}
+EXPORT_COLUMNS = ["Firm", "Region", "Topic", "Headline", "Impact", "Date", "Link"]  # database.DASHBOARD_COLUMNS
+INTEGER_COLUMNS = {"Impact"}
+
+
+def available_formats():
+    return ["csv"] + (["parquet"] if pq is not None else [])
+
+
+def available_compressions(fmt):
+    """Parquet compresses inside the file (per column chunk); CSV is wrapped whole."""
+    if fmt == "parquet":
+        return ["none", "gzip", "zstd"]
+    return ["none", "gzip"] + (["zstd"] if zstandard is not None else [])
+
+
+def file_suffix(fmt, compression=None):
+    if fmt == "csv" and compression not in (None, "none"):
+        return EXTENSIONS["csv"] + EXTENSIONS[compression]
+    return EXTENSIONS[fmt]
+
+
+def mime_type(fmt, compression=None):
+    if fmt == "csv" and compression not in (None, "none"):
+        return MIME_TYPES[compression]
+    return MIME_TYPES[fmt]
+
+
+def _open_text(path, compression):
+    if compression == "gzip":
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    if compression == "zstd":
+        return zstandard.open(path, "wt", cctx=zstandard.ZstdCompressor(level=ZSTD_LEVEL), encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="")
+
+
+def _write_csv(path, chunks, compression):
+    with _open_text(path, compression) as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        for _, rows in chunks:
+            writer.writerows(rows)
+
+
+def _schema(names):
+    return pa.schema([(n, pa.int64() if n in INTEGER_COLUMNS else pa.string()) for n in names])
+
+
+def _write_parquet(path, chunks, compression):
+    writer = None
+    try:
+        for names, rows in chunks:
+            if writer is None:
+                schema = _schema(names)
+                writer = pq.ParquetWriter(path, schema, compression=compression or "none")
+            columns = list(zip(*rows))
+            # One row group per chunk
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema))
+        if writer is None:
+            # No matching rows: still a valid (empty) file
+            writer = pq.ParquetWriter(path, _schema(EXPORT_COLUMNS), compression=compression or "none")
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _prune():
+    files = [os.path.join(EXPORT_DIR, name) for name in os.listdir(EXPORT_DIR) if not name.endswith(".tmp")]
+    files.sort(key=os.path.getmtime, reverse=True)
+    for path in files[EXPORT_CACHE_FILES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def build_export(fmt="csv", compression=None, region=None, topic=None, text=None):
+    """
+    Writes every article matching the Dashboard filters (and search text), live and
+    archived, to a file in EXPORT_DIR and returns its path. Rows are streamed from the
+    database EXPORT_CHUNK at a time. Returns the existing file, without querying, when
+    nothing has changed (archiving deletes from articles, so it bumps the data version too).
+    """
+    if fmt not in available_formats():
+        raise ValueError(f"Export format not available: {fmt}")
+    compression = None if compression == "none" else compression
+    if compression is not None and compression not in available_compressions(fmt):
+        raise ValueError(f"Compression not available for {fmt}: {compression}")
+
+    key = json.dumps([fmt, compression, region, topic, text or None, get_data_version("articles")])
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(EXPORT_DIR, f"articles_{digest}{file_suffix(fmt, compression)}")
+    if os.path.exists(path):
+        os.utime(path)  # recently used: kept by _prune()
+        return path
+
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    chunks = iter_all_articles(region, topic, text, EXPORT_CHUNK)
+    try:
+        if fmt == "parquet":
+            _write_parquet(tmp, chunks, compression)
+        else:
+            _write_csv(tmp, chunks, compression)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _prune()
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export stored articles.")
+    parser.add_argument("--format", default="csv", choices=["csv", "parquet"])
+    parser.add_argument("--compression", default="none", choices=["none", "gzip", "zstd"])
+    parser.add_argument("--region")
+    parser.add_argument("--topic")
+    parser.add_argument("--query", help="Full-text search, as in the Dashboard search box")
+    args = parser.parse_args()
+
+    init_db()
+    print(build_export(args.format, args.compression, args.region, args.topic, args.query))
@@ -0,0 +1,97 @@
+import datetime
+import email.utils
+import xml.etree.ElementTree as ET
+
+import feedparser
+
+# --- CONFIGURATION ---
+CHUNK_SIZE = 16 * 1024  # bytes pulled from the response per read
+FEED_ROOTS = {"rss", "feed", "RDF"}
+ENTRY_TAGS = {"item", "entry"}
+PUBLISHED_TAGS = {"pubDate", "published", "issued"}
+UPDATED_TAGS = {"updated", "modified", "date"}
+
+
+def _local(tag):
+    """Tag name without its XML namespace."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_date(text):
+    """RFC 822 or ISO 8601 date as a UTC struct_time, like feedparser's *_parsed fields."""
+    text = (text or "").strip()
+    if not text:
+        return None
+    try:
+        dt = email.utils.parsedate_to_datetime(text)
+    except (TypeError, ValueError):
+        try:
+            dt = datetime.datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    return dt.utctimetuple()
+
+
+def _entry(elem):
+    """Reads one <item>/<entry> element into the subset of feedparser's entry keys we use."""
+    entry = feedparser.FeedParserDict()
+    for child in elem:
+        name = _local(child.tag)
+        text = "".join(child.itertext()).strip()
+        if name == "link":
+            href = child.get("href")
+            if href is None:
+                entry.setdefault("link", text)
+            elif child.get("rel", "alternate") == "alternate":
+                entry.setdefault("link", href)
+        elif name in ("guid", "id"):
+            entry["id"] = text
+        elif name == "title":
+            entry["title"] = text
+        elif name in ("description", "summary"):
+            entry["summary"] = text
+        elif name in ("encoded", "content"):
+            entry.setdefault("summary", text)
+        elif name in PUBLISHED_TAGS:
+            entry["published_parsed"] = _parse_date(text)
+        elif name in UPDATED_TAGS:
+            entry["updated_parsed"] = _parse_date(text)
+    return entry
+
+
+def parse_stream(chunks, limit=None, accept=None):
+    """
+    Incremental RSS/Atom parser over an iterable of byte chunks.
+    Entries are built one at a time as their closing tag arrives and the rest of
+    the document is never read once `limit` entries have passed `accept(entry)`
+    (every entry counts when accept is None). Rejected entries are still returned,
+    so callers' own filters see the same entries in the same order.
+    Anything that isn't a well-formed feed is handed to feedparser as a whole.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    chunks = iter(chunks)
+    read, entries = [], []
+    root, usable = None, 0
+    try:
+        for chunk in chunks:
+            read.append(chunk)
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if root is None:
+                    root = _local(elem.tag)
+                    if root not in FEED_ROOTS:
+                        raise ET.ParseError(f"not a feed: <{root}>")
+                if event != "end" or _local(elem.tag) not in ENTRY_TAGS:
+                    continue
+                entry = _entry(elem)
+                elem.clear()  # the tree never holds more than the entry being read
+                entries.append(entry)
+                if accept is None or accept(entry):
+                    usable += 1
+                    if limit is not None and usable >= limit:
+                        return feedparser.FeedParserDict(feed={}, entries=entries, bozo=False, truncated=True)
+        parser.close()
+    except ET.ParseError:
+        # Malformed or not XML at all: feedparser's lenient parser gets the full body
+        return feedparser.parse(b"".join(read) + b"".join(chunks))
+    return feedparser.FeedParserDict(feed={}, entries=entries, bozo=False, truncated=False)
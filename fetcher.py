@@ -0,0 +1,476 @@
+import atexit
+import collections
+import email.utils
+import os
+import pickle
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import feedparser
+import requests
+
+from database import get_feed_cache, save_feed_cache, get_feed_states, save_feed_states
+from feedstream import parse_stream, CHUNK_SIZE
+from snapshots import snapshot_results, SNAPSHOT_FEEDS
+
+# --- CONFIGURATION ---
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 15  # seconds, applied to connect and to each read
+PER_HOST_LIMIT = 4    # max in-flight requests per host
+# Requests per second per host (token bucket, bursts up to HOST_BURST). Hosts not listed are
+# only capped by PER_HOST_LIMIT until they push back with a 429 / 503.
+# Limits are per process: N processes fetching one host send up to N times its rate, so each
+# takes 1/HOST_RATE_SHARE of it (sharded aggregator workers set this to their shard count).
+HOST_RATES = {"news.google.com": 2.0, "www.bing.com": 2.0}
+HOST_RATE_SHARE = int(os.environ.get("KB_RATE_SHARE", 1))
+HOST_BURST = 4
+THROTTLED_RATE = 2.0       # starting rate for an unlisted host that pushed back
+MIN_HOST_RATE = 0.1
+RATE_RECOVERY = 0.25       # req/s regained per successful response
+# 429 / 503 slow down and back off the whole host; other 5xx only retry the one request
+HOST_PUSHBACK_STATUSES = {429, 503}
+BACKOFF_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 1.0         # seconds, doubled per retry / consecutive push-back (when there's no Retry-After)
+BACKOFF_MAX = 300.0
+MAX_RETRIES = 2
+MAX_RETRY_WAIT = 30.0      # longer waits fail the request instead; the host stays backed off
+# Circuit breakers (state in the feed_state table): a source that failed BREAKER_FAILURES syncs
+# in a row, or returned no entries BREAKER_EMPTY_SYNCS times in a row, is skipped for a cooldown
+# that doubles each time it trips again. After the cooldown one sync tries it again. A host
+# pushing back (429 / 503) is the limiter's business and does not count against its sources.
+BREAKER_FAILURES = 3
+BREAKER_EMPTY_SYNCS = 5
+BREAKER_COOLDOWN = 30 * 60
+BREAKER_MAX_COOLDOWN = 24 * 60 * 60
+USER_AGENT = "Mozilla/5.0 (compatible; StrategicKnowledgeDashboard/1.0)"
+# Processes for the CPU half of a sync (parse, score, classify); 0 or 1 keeps it in-process
+PARSE_WORKERS = int(os.environ.get("KB_PARSE_WORKERS", 0))
+
+
+class HostLimiter:
+    """
+    Per-host politeness: at most `per_host` concurrent requests, and a token bucket
+    of HOST_RATES[host] requests per second. A 429 or 503 halves the host's rate and
+    blocks it for Retry-After (or an exponential backoff); each success gives back
+    RATE_RECOVERY req/s. State is created lazily, one entry per host. Rates are divided
+    by `share` (default HOST_RATE_SHARE), the number of processes splitting each host.
+    """
+
+    def __init__(self, per_host=PER_HOST_LIMIT, rates=None, share=None):
+        self.per_host = per_host
+        self.share = share or HOST_RATE_SHARE
+        self.rates = {host: rate / self.share for host, rate in (HOST_RATES if rates is None else rates).items()}
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        host = urllib.parse.urlsplit(url).netloc.lower()
+        with self._lock:
+            if host not in self._hosts:
+                rate = self.rates.get(host)
+                self._hosts[host] = {"slot": threading.BoundedSemaphore(self.per_host), "base": rate, "rate": rate,
+                                     "tokens": float(HOST_BURST), "updated": time.monotonic(),
+                                     "blocked_until": 0.0, "strikes": 0}
+            return self._hosts[host]
+
+    def slot(self, url):
+        return self._host(url)["slot"]
+
+    def wait(self, url, max_wait=None):
+        """
+        Blocks until the host is out of backoff and its bucket has a token. Returns False
+        at once, without taking a token, if the backoff lasts longer than max_wait.
+        """
+        state = self._host(url)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = state["blocked_until"] - now
+                if max_wait is not None and delay > max_wait:
+                    return False
+                if delay <= 0:
+                    if state["rate"] is None:
+                        return True
+                    state["tokens"] = min(HOST_BURST, state["tokens"] + (now - state["updated"]) * state["rate"])
+                    state["updated"] = now
+                    if state["tokens"] >= 1:
+                        state["tokens"] -= 1
+                        return True
+                    delay = (1 - state["tokens"]) / state["rate"]
+            time.sleep(delay)
+
+    def throttled(self, url, retry_after=None):
+        """Records a push-back from the host. Returns the seconds it is now blocked for."""
+        state = self._host(url)
+        with self._lock:
+            state["strikes"] += 1
+            state["rate"] = max(MIN_HOST_RATE, (state["rate"] or THROTTLED_RATE / self.share) / 2)
+            if retry_after is None:
+                # Jittered so the threads waiting on one host don't all come back at once
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (state["strikes"] - 1)) * random.uniform(0.5, 1.0)
+            else:
+                delay = min(BACKOFF_MAX, retry_after)
+            now = time.monotonic()
+            state["blocked_until"] = max(state["blocked_until"], now + delay)
+            state["updated"] = now
+            return state["blocked_until"] - now
+
+    def succeeded(self, url):
+        state = self._host(url)
+        with self._lock:
+            state["strikes"] = 0
+            if state["rate"] is not None and state["rate"] != state["base"]:
+                state["rate"] += RATE_RECOVERY
+                if state["base"] is not None:
+                    state["rate"] = min(state["base"], state["rate"])
+                elif state["rate"] >= THROTTLED_RATE / self.share:
+                    state["rate"] = None  # an unlisted host is back to unthrottled
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def shared_limiter(per_host=PER_HOST_LIMIT):
+    """One HostLimiter per process (and per_host / HOST_RATE_SHARE setting), so backoff carries over between syncs."""
+    key = (per_host, HOST_RATE_SHARE)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = HostLimiter(per_host)
+        return _limiters[key]
+
+
+def _retry_after(resp):
+    """Seconds asked for by a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_one(url, session=None, timeout=DEFAULT_TIMEOUT, limiter=None, validators=None, max_entries=None, accept=None,
+              keep_body=False, parse=True):
+    """
+    Downloads and parses a single feed. Never raises: failures are
+    reported through the 'error' key so one bad source can't break a sync.
+    `validators` is an (etag, last_modified) pair from the previous sync; when the
+    server answers 304 Not Modified the body is neither downloaded nor parsed.
+    With `max_entries` the body is streamed through parse_stream(), which stops
+    reading once that many entries have passed `accept`.
+    `keep_body` adds the complete raw body under 'body' (the unparsed rest is still downloaded).
+    With parse=False the body is only downloaded, into 'body'.
+    429 / 5xx answers are retried up to MAX_RETRIES times when the wait (Retry-After or
+    exponential backoff) is at most MAX_RETRY_WAIT; 429 / 503 also back the limiter's host off.
+    A request given up because the host pushed back (a final 429 / 503, or a host backed
+    off for longer than MAX_RETRY_WAIT, which is not requested at all) has 'throttled': True.
+    """
+    result = {"url": url, "status": None, "feed": None, "error": None, "elapsed": 0.0,
+              "etag": None, "last_modified": None, "bytes": 0, "parse_s": 0.0}
+    start = time.perf_counter()
+    getter = session or requests
+    slot = limiter.slot(url) if limiter else None
+    headers = {"User-Agent": USER_AGENT}
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    body = None
+    pause = 0.0
+    try:
+        for attempt in range(MAX_RETRIES + 1):
+            time.sleep(pause)
+            if limiter and not limiter.wait(url, MAX_RETRY_WAIT):
+                result["error"] = f"{urllib.parse.urlsplit(url).netloc} is backing off after 429 / 503 answers"
+                result["throttled"] = True
+                break
+            if slot:
+                slot.acquire()
+            try:
+                # Closing the response also drops whatever part of the body was left unread
+                with getter.get(url, timeout=timeout, headers=headers, stream=True) as resp:
+                    result["status"] = resp.status_code
+                    result["etag"] = resp.headers.get("ETag")
+                    result["last_modified"] = resp.headers.get("Last-Modified")
+                    if resp.status_code in BACKOFF_STATUSES:
+                        retry_after = _retry_after(resp)
+                        if limiter and resp.status_code in HOST_PUSHBACK_STATUSES:
+                            # limiter.wait() holds the retry back
+                            wait, pause = limiter.throttled(url, retry_after), 0.0
+                        else:
+                            wait = pause = (retry_after if retry_after is not None
+                                            else BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1.0))
+                        if attempt < MAX_RETRIES and wait <= MAX_RETRY_WAIT:
+                            continue
+                        result["throttled"] = resp.status_code in HOST_PUSHBACK_STATUSES
+                    elif limiter:
+                        limiter.succeeded(url)
+                    if resp.status_code == 304:
+                        result["etag"] = result["etag"] or (validators and validators[0])
+                        result["last_modified"] = result["last_modified"] or (validators and validators[1])
+                    else:
+                        resp.raise_for_status()
+                        if max_entries is None or not parse:
+                            body = resp.content
+                            result["bytes"] = len(body)
+                        else:
+                            read, waited = [], [0.0]
+                            chunks = _tee(resp.iter_content(CHUNK_SIZE), read, waited)
+                            parse_start = time.perf_counter()
+                            result["feed"] = parse_stream(chunks, max_entries, accept)
+                            # Time spent waiting on the network inside the parser is not parse time
+                            result["parse_s"] = time.perf_counter() - parse_start - waited[0]
+                            if keep_body:
+                                collections.deque(chunks, maxlen=0)  # drain what the parser left unread
+                                result["body"] = b"".join(read)
+                            result["bytes"] = sum(len(chunk) for chunk in read)
+            finally:
+                if slot:
+                    slot.release()
+            break
+        if body is not None:
+            if parse:
+                parse_start = time.perf_counter()
+                result["feed"] = feedparser.parse(body)
+                result["parse_s"] = time.perf_counter() - parse_start
+            if keep_body or not parse:
+                result["body"] = body
+    except Exception as e:
+        result["error"] = str(e)
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+def _tee(chunks, read, waited):
+    """Passes chunks through, keeping each one in `read` and adding the time spent waiting to waited[0]."""
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        waited[0] += time.perf_counter() - start
+        if chunk is None:
+            return
+        read.append(chunk)
+        yield chunk
+
+
+def fetch_feeds(urls, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, per_host=PER_HOST_LIMIT, validators=None,
+                max_entries=None, accept=None, snapshot=SNAPSHOT_FEEDS, parse=True):
+    """
+    Fetches many feeds concurrently on a thread pool.
+    Results come back in the same order as `urls`, whatever order they finish in.
+    workers=1 gives the old sequential behaviour.
+    With `snapshot` every downloaded body is kept in the snapshot store for replay.
+    With parse=False feeds are only downloaded and each result keeps its raw 'body'.
+    """
+    urls = list(urls)
+    validators = validators or {}
+    limiter = shared_limiter(per_host)
+    with requests.Session() as session:
+        # Let the connection pool hold as many sockets as we have workers
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(
+                lambda u: fetch_one(u, session, timeout, limiter, validators.get(u), max_entries, accept, snapshot, parse), urls
+            ))
+    if snapshot:
+        snapshot_results(results)
+    if parse:
+        for result in results:
+            result.pop("body", None)
+    return results
+
+
+# --- PARSE POOL ---
+# One process pool, kept across syncs. Its task goes to each worker once, through the pool
+# initializer; a call with another task (or worker count) replaces the pool.
+_parse_pool = {"pool": None, "workers": 0, "task": None}
+_parse_pool_lock = threading.Lock()
+_worker_task = None  # set in pool workers by _init_worker()
+
+
+def _run_task(task, arg, body):
+    """Worker side of run_tasks(): never raises, so one bad feed can't take down a batch."""
+    start = time.perf_counter()
+    try:
+        rows, entries = task(arg, body)
+        return rows, entries, None, time.perf_counter() - start
+    except Exception as e:
+        return [], 0, str(e), time.perf_counter() - start
+
+
+def _init_worker(task):
+    global _worker_task
+    _worker_task = pickle.loads(task)
+
+
+def _run_pooled(arg, body):
+    return _run_task(_worker_task, arg, body)
+
+
+def _shared_parse_pool(task, workers):
+    """The parse pool for this task, started if there is none for it yet. Called under _parse_pool_lock."""
+    payload = pickle.dumps(task)
+    if _parse_pool["pool"] is None or (_parse_pool["workers"], _parse_pool["task"]) != (workers, payload):
+        _close_parse_pool()
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(payload,))
+        _parse_pool.update(pool=pool, workers=workers, task=payload)
+    return _parse_pool["pool"]
+
+
+def _close_parse_pool():
+    pool, _parse_pool["pool"] = _parse_pool["pool"], None
+    if pool:
+        pool.shutdown(cancel_futures=True)
+
+
+atexit.register(_close_parse_pool)
+
+
+def run_tasks(task, items, workers=PARSE_WORKERS):
+    """
+    Runs task(arg, body) over (arg, body) pairs, batched across `workers` processes when
+    workers > 1. The task must be picklable (a module-level function or a partial of
+    one) and return (rows, entries parsed). It is sent to each worker once and the pool
+    is reused by later calls with the same task, so only the pairs travel per item.
+    Returns (rows, entries, error, seconds) per item, in order. Falls back to this
+    process if the pool can't start or breaks; the next call starts a fresh one.
+    """
+    items = list(items)
+    if workers > 1 and len(items) > 1:
+        with _parse_pool_lock:
+            try:
+                pool = _shared_parse_pool(task, workers)
+                args, bodies = zip(*items)
+                return list(pool.map(_run_pooled, args, bodies, chunksize=max(1, len(items) // (workers * 4))))
+            except Exception as e:
+                _close_parse_pool()
+                print(f"Parse pool unavailable ({e}); parsing in-process.")
+    return [_run_task(task, arg, body) for arg, body in items]
+
+
+def fetch_cached(urls, process, namespace, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, per_host=PER_HOST_LIMIT,
+                 max_entries=None, accept=None, task=None, task_args=None, parse_workers=PARSE_WORKERS,
+                 save_cache=True):
+    """
+    Conditional-GET sync. Sends each feed's stored ETag / Last-Modified and adds
+    a 'rows' key to every result: process(i, feed) for feeds that changed, or the
+    rows kept from the previous sync when the server answers 304 Not Modified.
+    Unchanged feeds therefore skip parsing and scoring entirely.
+    `namespace` separates callers whose processed rows have different shapes.
+    `max_entries` / `accept` are passed on to fetch_one().
+    With a picklable `task` and parse_workers > 1, threads only download: changed
+    feeds are parsed and processed by task(task_args[i], body) (task_args defaults to
+    the indexes) on a process pool (see run_tasks), so scoring scales with cores
+    instead of sharing the GIL with the fetch threads.
+    Sources whose circuit breaker is open are not requested; their results carry
+    'skipped': True and an error saying until when.
+    With save_cache=False the new cache entries are left on the results (see
+    cache_entries()) for the caller to store with the articles it makes of them:
+    validators saved first would turn a crash in between into a 304 next time,
+    and the feed's entries would never be stored.
+    """
+    urls = list(urls)
+    cache = get_feed_cache(namespace, urls)
+    validators = {url: (c["etag"], c["last_modified"]) for url, c in cache.items()}
+    pooled = task is not None and parse_workers > 1
+    now = time.time()
+    states = get_feed_states(urls)
+    tripped = {url for url, state in states.items() if state["open_until"] and state["open_until"] > now}
+    fetched = iter(fetch_feeds([url for url in urls if url not in tripped], workers, timeout, per_host, validators,
+                               max_entries, accept, parse=not pooled))
+    results = [_skipped(url, states[url]) if url in tripped else next(fetched) for url in urls]
+    if pooled:
+        changed = [(i, r.pop("body")) for i, r in enumerate(results) if "body" in r and not r["error"]]
+        args = task_args if task_args is not None else range(len(urls))
+        processed = run_tasks(task, [(args[i], body) for i, body in changed], parse_workers)
+        for (i, _), (rows, entries, error, seconds) in zip(changed, processed):
+            results[i].update({"rows": rows, "entries": entries, "error": error, "process_s": seconds})
+
+    updates = []
+    for i, result in enumerate(results):
+        pooled_rows, result["rows"] = result.get("rows", []), []
+        if result["error"]:
+            continue
+        if result["status"] == 304:
+            result["rows"] = cache.get(result["url"], {}).get("entries", [])
+            continue
+        if pooled:
+            result["rows"] = pooled_rows
+        else:
+            start = time.perf_counter()
+            try:
+                result["rows"] = process(i, result["feed"])
+            except Exception as e:
+                result["error"] = str(e)
+                continue
+            finally:
+                result["process_s"] = time.perf_counter() - start
+        updates.append((result["url"], result["etag"], result["last_modified"], result["rows"]))
+        if not save_cache:
+            result["cache_entry"] = updates[-1]
+
+    if updates and save_cache:
+        save_feed_cache(namespace, updates)
+    save_feed_states(_breaker_updates(results, states, now))
+    return results
+
+
+def cache_entries(results):
+    """Feed-cache items that fetch_cached(save_cache=False) left for the caller to store."""
+    return [result["cache_entry"] for result in results if "cache_entry" in result]
+
+
+def _skipped(url, state):
+    until = time.strftime("%Y-%m-%d %H:%M", time.localtime(state["open_until"]))
+    return {"url": url, "status": None, "feed": None, "error": f"circuit open until {until} ({state['reason']})",
+            "elapsed": 0.0, "etag": None, "last_modified": None, "bytes": 0, "parse_s": 0.0, "rows": [], "skipped": True}
+
+
+def _breaker_updates(results, states, now):
+    """
+    New breaker state of every source that was actually fetched. Host-level push-back
+    (429 / 503, see fetch_one()) says nothing about the source, so it is not counted.
+    A 304 repeats the last full fetch: it counts as empty when that one was.
+    """
+    updates = []
+    for result in results:
+        if result.get("skipped") or result.get("throttled"):
+            continue
+        state = dict(states.get(result["url"]) or {"failures": 0, "empty_syncs": 0, "trips": 0})
+        state.update(url=result["url"], open_until=None, reason=None, last_error=result["error"])
+        if result["error"]:
+            state["failures"] += 1
+        else:
+            state["failures"] = 0
+            if result["status"] == 304:
+                # Still the same feed: empty again if the last full fetch was empty
+                if state["empty_syncs"]:
+                    state["empty_syncs"] += 1
+            else:
+                feed = result.get("feed")
+                entries = len(feed.entries) if feed is not None else result.get("entries", 0)
+                state["empty_syncs"] = 0 if entries else state["empty_syncs"] + 1
+        if state["failures"] >= BREAKER_FAILURES or state["empty_syncs"] >= BREAKER_EMPTY_SYNCS:
+            # Counters are kept while open: one more bad sync after the cooldown trips it again, for longer
+            state["trips"] += 1
+            state["open_until"] = now + min(BREAKER_MAX_COOLDOWN, BREAKER_COOLDOWN * 2 ** (state["trips"] - 1))
+            state["reason"] = (f"{state['failures']} failed syncs in a row" if state["failures"] >= BREAKER_FAILURES
+                               else f"{state['empty_syncs']} empty syncs in a row")
+        elif not result["error"] and state["empty_syncs"] == 0:
+            state["trips"] = 0
+        updates.append(state)
+    return updates
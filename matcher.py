@@ -0,0 +1,166 @@
+import json
+import re
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+# Words are runs of letters/digits, so "net-zero" and "net zero" tokenize alike. "&" joins
+# letters into one word, so "m&a" or "r&d" is not the phrase "m a" (as in "I'm a ...")
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:&[a-z0-9]+)*")
+# ASCII characters no word can contain, mapped to spaces (match_frame() splits on them),
+# except _ROW_END, which match_frame() takes out of the texts and puts between them
+_ROW_END = "|"
+_SEPARATORS = str.maketrans({c: " " for c in map(chr, range(128)) if not re.fullmatch(r"[a-z0-9&|]", c)})
+_END = None  # trie key holding the (group, label) outputs of a complete phrase
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+class KeywordMatcher:
+    """
+    Whole-word multi-keyword matcher.
+    Keyword phrases are stored in a trie keyed by word, so a text is matched in
+    one pass over its words. Cost depends on the text length and the longest
+    phrase, not on how many rules are loaded.
+    """
+
+    def __init__(self):
+        self._root = {}
+        self._tables = None  # match_frame() arrays, rebuilt after rules change
+        self.max_words = 0
+        self.size = 0
+
+    def __getstate__(self):
+        # The match_frame() tables are rebuilt on demand, so pickles (e.g. for pool workers) leave them out
+        state = self.__dict__.copy()
+        state["_tables"] = None
+        return state
+
+    def add(self, group, label, phrase):
+        words = tokenize(phrase)
+        if not words:
+            return
+        node = self._root
+        for word in words:
+            node = node.setdefault(word, {})
+        node.setdefault(_END, []).append((group, label))
+        self._tables = None
+        self.max_words = max(self.max_words, len(words))
+        self.size += 1
+
+    def add_terms(self, group, terms):
+        """
+        Adds a group of rules. `terms` is either a list of phrases (each its own
+        label) or a dict mapping a label to the list of phrases that trigger it.
+        """
+        if isinstance(terms, dict):
+            for label, phrases in terms.items():
+                for phrase in ([phrases] if isinstance(phrases, str) else phrases):
+                    self.add(group, label, phrase)
+        else:
+            for phrase in terms:
+                self.add(group, phrase, phrase)
+
+    def match(self, text):
+        """Returns {group: set(labels)} for every rule found in text."""
+        words = tokenize(text)
+        hits = {}
+        for i in range(len(words)):
+            node = self._root
+            for word in words[i:]:
+                node = node.get(word)
+                if node is None:
+                    break
+                for group, label in node.get(_END, ()):
+                    hits.setdefault(group, set()).add(label)
+        return hits
+
+    def match_frame(self, texts):
+        """
+        Match over a whole column of texts at once.
+        Returns a DataFrame with one (row, group, label) line per distinct hit,
+        where row is the position of the text in `texts`. All texts are split in one
+        go and only their distinct chunks go through TOKEN_RE; the trie is then walked
+        from every word together, one NumPy step per phrase word, on integer word ids.
+        """
+        tables = self._tables or self._compile()
+        texts = pd.Series(texts, dtype=object).fillna("").astype(str).str.replace(_ROW_END, " ", regex=False)
+        # Cut at characters no word can contain, with a _ROW_END chunk where each text ends
+        chunks = f" {_ROW_END} ".join(texts.tolist()).lower().translate(_SEPARATORS).split()
+        codes, distinct = pd.factorize(np.array(chunks, dtype=object))
+        words = [TOKEN_RE.findall(chunk) for chunk in distinct]  # "&" has none, "café" has "caf"
+        per_chunk = np.array([len(w) for w in words], dtype=np.int64)
+        counts = per_chunk[codes]
+        rows = np.repeat(np.cumsum((distinct == _ROW_END)[codes]), counts)
+        word_ids = tables["vocab"].get_indexer(list(chain.from_iterable(words)))  # -1: in no phrase
+        offsets = np.cumsum(per_chunk) - per_chunk
+        ids = word_ids[np.repeat(offsets[codes] - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+        edge_keys, size, last = tables["edge_keys"], tables["size"], len(ids) - 1
+
+        found_rows, found_nodes = [np.empty(0, np.int64)], [np.empty(0, np.int64)]
+        start = np.flatnonzero(ids >= 0)
+        state = np.zeros(len(start), dtype=np.int64)  # trie node reached from each start word
+        for step in range(self.max_words):
+            at = np.minimum(start + step, last)
+            keys = state * size + ids[at]
+            slot = np.minimum(np.searchsorted(edge_keys, keys), len(edge_keys) - 1)
+            ok = (start + step <= last) & (rows[at] == rows[start]) & (ids[at] >= 0) & (edge_keys[slot] == keys)
+            start, state = start[ok], tables["children"][slot[ok]]
+            found_rows.append(rows[start])
+            found_nodes.append(state)
+
+        # Every output of every node reached, once per row
+        rows, nodes = np.concatenate(found_rows), np.concatenate(found_nodes)
+        counts = tables["out_counts"][nodes]
+        outs = tables["outs"][np.repeat(tables["out_offsets"][nodes] - np.cumsum(counts) + counts, counts)
+                              + np.arange(counts.sum())]
+        hits = pd.unique(np.repeat(rows, counts) * len(tables["groups"]) + outs)
+        rows, outs = np.divmod(hits, max(len(tables["groups"]), 1))
+        return pd.DataFrame({"row": rows, "group": tables["groups"].take(outs), "label": tables["labels"].take(outs)})
+
+    def _compile(self):
+        """
+        Flattens the trie into arrays for match_frame(): a word -> id index, the
+        (node * vocabulary size + word id) keys of all edges, sorted, with their
+        child nodes, and the distinct outputs of every node (node i owns
+        outs[out_offsets[i]:out_offsets[i] + out_counts[i]]). Groups and labels are
+        Categoricals, so filtering hits by them is cheap.
+        """
+        vocab, edges, node_outs, out_ids = {}, [], [[]], {}
+        stack = [(self._root, 0)]
+        while stack:
+            node, node_id = stack.pop()
+            for word, child in node.items():
+                if word is _END:
+                    node_outs[node_id] = sorted({out_ids.setdefault(output, len(out_ids)) for output in child})
+                    continue
+                edges.append((node_id, vocab.setdefault(word, len(vocab)), len(node_outs)))
+                stack.append((child, len(node_outs)))
+                node_outs.append([])
+
+        size = max(len(vocab), 1)
+        edges = np.array(edges, dtype=np.int64).reshape(-1, 3)
+        keys = edges[:, 0] * size + edges[:, 1]
+        order = np.argsort(keys)
+        out_counts = np.array([len(outs) for outs in node_outs], dtype=np.int64)
+        self._tables = {
+            "vocab": pd.Index(list(vocab), dtype=object),
+            "size": size,
+            "edge_keys": keys[order],
+            "children": edges[order, 2],
+            "out_counts": out_counts,
+            "out_offsets": np.cumsum(out_counts) - out_counts,
+            "outs": np.array([out for outs in node_outs for out in outs], dtype=np.int64),
+            "groups": pd.Categorical([group for group, _ in out_ids]),
+            "labels": pd.Categorical([label for _, label in out_ids])
+        }
+        return self._tables
+
+
+def load_rules(path):
+    """Loads keyword rules from a JSON file, e.g. {"weights": {...}, "noise": [...], "topics": {...}}."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
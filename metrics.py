@@ -0,0 +1,184 @@
+import cProfile
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager, nullcontext
+
+from database import init_db, save_metrics, get_source_health, get_stage_metrics
+
+# --- CONFIGURATION ---
+# Set KB_PROFILE=<path> to profile the next tracked run: writes <path>.prof (cProfile)
+# and <path>.txt (top functions and tracemalloc allocation sites). One run only.
+PROFILE_ENV = "KB_PROFILE"
+PROFILE_TOP = 30
+METRIC_PREFIX = "kb"
+
+_active = None
+_active_lock = threading.Lock()
+
+
+class Run:
+    """
+    Metrics of one sync: a record per source and accumulated time per stage.
+    Stage times are summed across fetch threads, so they can add up to more
+    than the wall time of the run. There is one active run per process;
+    syncs started while it is open are counted into it.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.run_id = uuid.uuid4().hex[:12]
+        self.sources = []
+        self.stages = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add_time(self, stage, seconds, calls=1):
+        with self._lock:
+            total, count = self.stages.get(stage, (0.0, 0))
+            self.stages[stage] = (total + seconds, count + calls)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def record_fetches(self, names, results):
+        """Adds one source record per fetch result (results aligned with names)."""
+        for name, result in zip(names, results):
+            feed = result.get("feed")
+            entries = len(feed.entries) if feed is not None else result.get("entries", 0)
+            kept = len(result.get("rows") or ())
+            self.sources.append({
+                "source": name,
+                "url": result["url"],
+                "status": result["status"],
+                "latency_ms": round(result.get("elapsed", 0.0) * 1000, 1),
+                "bytes": result.get("bytes", 0),
+                "entries": entries,
+                "kept": kept,
+                "filtered": max(0, entries - kept) if result["status"] != 304 else 0,
+                "error": result["error"],
+            })
+            if result.get("parse_s"):
+                self.add_time("parse", result["parse_s"])
+            if result.get("process_s"):
+                self.add_time("process", result["process_s"])
+
+    def save(self):
+        self.add_time("total", time.perf_counter() - self.started)
+        save_metrics(self.run_id, self.pipeline, self.sources, self.stages)
+
+
+def stage(name):
+    """Times a block into the active run; a no-op when nothing is being tracked."""
+    run = _active
+    return run.stage(name) if run is not None else nullcontext()
+
+
+def current():
+    return _active
+
+
+@contextmanager
+def track(pipeline, profile=None):
+    """
+    Collects metrics for everything inside the block and stores them when it ends.
+    Nested calls join the run already in progress. `profile` (or $KB_PROFILE, once)
+    names the output path for a cProfile/tracemalloc capture of this run.
+    """
+    global _active
+    with _active_lock:
+        outer = _active is not None
+        if not outer:
+            _active = Run(pipeline)
+        run = _active
+    if outer:
+        yield run
+        return
+    profile = profile or os.environ.pop(PROFILE_ENV, None)
+    try:
+        with (profiled(profile) if profile else nullcontext()):
+            yield run
+    finally:
+        with _active_lock:
+            _active = None
+        try:
+            run.save()
+        except Exception as e:
+            # Metrics must never fail a sync
+            print(f"Could not store metrics: {e}")
+
+
+@contextmanager
+def profiled(path):
+    """
+    cProfile + tracemalloc around a block. Writes <path>.prof and a readable <path>.txt.
+    cProfile only sees the calling thread: profile with workers=1 to include fetch and parse.
+    """
+    profiler = cProfile.Profile()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+        profiler.dump_stats(f"{path}.prof")
+        with open(f"{path}.txt", "w", encoding="utf-8") as f:
+            pstats.Stats(profiler, stream=f).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            f.write(f"\nMemory: current {current_bytes / 1e6:.1f} MB, peak {peak_bytes / 1e6:.1f} MB\n")
+            f.write(f"Top {PROFILE_TOP} allocation sites:\n")
+            for line in snapshot.statistics("lineno")[:PROFILE_TOP]:
+                f.write(f"{line}\n")
+
+
+# --- EXPORT ---
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text():
+    """Latest per-source and per-stage metrics in the Prometheus text exposition format."""
+    health = get_source_health()
+    stages = get_stage_metrics()
+    lines = []
+
+    def gauge(name, help_text, samples):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} gauge")
+        for labels, value in samples:
+            if value is None or value != value:  # skip NULL / NaN
+                continue
+            label_text = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            lines.append(f"{METRIC_PREFIX}_{name}{{{label_text}}} {float(value):g}")
+
+    per_source = [({"source": row.source, "url": row.url}, row) for row in health.itertuples()]
+    gauge("source_up", "1 if the last fetch succeeded", [(l, 0 if isinstance(r.last_error, str) else 1) for l, r in per_source])
+    gauge("source_http_status", "HTTP status of the last fetch", [(l, r.status) for l, r in per_source])
+    gauge("source_fetch_latency_ms", "Latency of the last fetch", [(l, r.latency_ms) for l, r in per_source])
+    gauge("source_response_bytes", "Body bytes read on the last fetch", [(l, r.bytes) for l, r in per_source])
+    gauge("source_entries", "Entries parsed on the last fetch", [(l, r.entries) for l, r in per_source])
+    gauge("source_kept", "Entries kept after filtering on the last fetch", [(l, r.kept) for l, r in per_source])
+    gauge("source_filtered", "Entries dropped by the filters on the last fetch", [(l, r.filtered) for l, r in per_source])
+    gauge("source_error_ratio", "Share of failed fetches over the retention window", [(l, r.error_ratio) for l, r in per_source])
+    gauge("stage_seconds", "Time spent per stage in the latest run of each pipeline",
+          [({"pipeline": row.pipeline, "stage": row.stage}, row.seconds) for row in stages.itertuples()])
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    init_db()
+    print(prometheus_text(), end="")
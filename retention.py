@@ -0,0 +1,324 @@
+import argparse
+import datetime
+import glob
+import os
+import re
+import sqlite3
+import zlib
+
+import pandas as pd
+
+import database
+import snapshots
+from database import DB_PATH, DASHBOARD_COLUMNS, ARTICLE_ORDERS, get_connection, transaction, article_filters
+
+# --- CONFIGURATION ---
+# Tiers: everything published in the last HOT_DAYS stays in research.db; up to WARM_DAYS
+# only articles with impact >= KEEP_IMPACT do; the rest moves to one SQLite file per
+# publication month under ARCHIVE_DIR. Saved items are never archived.
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "archive")
+HOT_DAYS = 90
+WARM_DAYS = 365
+KEEP_IMPACT = 70
+VACUUM_PAGES = 2000                # free pages handed back per incremental_vacuum step
+RETENTION_INTERVAL = 24 * 60 * 60  # how often the scheduler runs maintain()
+
+# Archive partitions keep no FTS and no secondary indexes; summaries are zlib-compressed
+PARTITION_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS part.articles (
+        url TEXT PRIMARY KEY,
+        link_key INTEGER,
+        title TEXT,
+        firm TEXT,
+        published_date DATE,
+        summary BLOB,
+        impact_score INTEGER,
+        region TEXT,
+        topic TEXT,
+        guid TEXT,
+        ingested_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+PARTITION_COLUMNS = "url, link_key, title, firm, published_date, summary, impact_score, region, topic, guid, ingested_at"
+ARCHIVABLE = '''
+    published_date IS NOT NULL
+    AND (published_date < :warm_cutoff OR (published_date < :hot_cutoff AND COALESCE(impact_score, 0) < :keep_impact))
+    AND link_key NOT IN (SELECT link_key FROM saved_items WHERE link_key IS NOT NULL)
+'''
+
+
+def _deflate(text):
+    return zlib.compress(text.encode("utf-8")) if text is not None else None
+
+
+def _inflate(blob):
+    return zlib.decompress(blob).decode("utf-8") if blob is not None else None
+
+
+def _partition_path(month):
+    return os.path.join(ARCHIVE_DIR, f"articles_{month}.db")
+
+
+def _partitions(start=None, end=None):
+    """(month, path) of the archive files overlapping [start, end], newest first."""
+    found = []
+    for path in glob.glob(os.path.join(ARCHIVE_DIR, "articles_*.db")):
+        month = os.path.basename(path)[len("articles_"):-len(".db")]
+        if start is not None and month < str(start)[:7]:
+            continue
+        if end is not None and month > str(end)[:7]:
+            continue
+        found.append((month, path))
+    return sorted(found, reverse=True)
+
+
+def _cutoffs(today=None):
+    today = today or datetime.date.today()
+    return {
+        "hot_cutoff": str(today - datetime.timedelta(days=HOT_DAYS)),
+        "warm_cutoff": str(today - datetime.timedelta(days=WARM_DAYS)),
+        "keep_impact": KEEP_IMPACT,
+    }
+
+
+def archive_articles(today=None):
+    """
+    Moves articles past their tier into the monthly archive files and records their
+    keys in archived_keys. Copies are INSERT OR IGNORE and the delete follows the copy,
+    so an interrupted run is finished by the next one. Returns how many were moved.
+    """
+    params = _cutoffs(today)
+    conn = get_connection()
+    conn.create_function("deflate", 1, _deflate, deterministic=True)
+    months = [row[0] for row in conn.execute(
+        f"SELECT DISTINCT substr(published_date, 1, 7) FROM articles WHERE {ARCHIVABLE}", params)]
+    moved = 0
+    for month in months:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        # ATTACH can't run inside a transaction
+        conn.execute("ATTACH DATABASE ? AS part", (_partition_path(month),))
+        try:
+            conn.execute(PARTITION_SCHEMA)
+            where = f"{ARCHIVABLE} AND substr(published_date, 1, 7) = :month"
+            with transaction():
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO part.articles ({PARTITION_COLUMNS})
+                    SELECT url, link_key, title, firm, published_date, deflate(summary), impact_score,
+                           region, topic, guid, ingested_at
+                    FROM main.articles WHERE {where}
+                ''', dict(params, month=month))
+                conn.execute(f'''
+                    INSERT OR IGNORE INTO archived_keys (link_key, partition)
+                    SELECT link_key, :month FROM main.articles WHERE {where}
+                ''', dict(params, month=month))
+                moved += conn.execute(f"DELETE FROM main.articles WHERE {where}", dict(params, month=month)).rowcount
+        finally:
+            conn.execute("DETACH DATABASE part")
+    return moved
+
+
+def prune_fingerprints(today=None):
+    """Near-duplicate fingerprints only matter for recent items: drops those older than HOT_DAYS."""
+    with transaction() as conn:
+        return conn.execute("DELETE FROM fingerprints WHERE created_at < ?", (_cutoffs(today)["hot_cutoff"],)).rowcount
+
+
+def enable_incremental_vacuum():
+    """
+    One-off conversion of an existing research.db to auto_vacuum=INCREMENTAL. Needs a full
+    VACUUM (rewrites the file; nothing else may write meanwhile). Article rowids are their
+    link keys, so articles_fts stays aligned.
+    """
+    conn = get_connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    return True
+
+
+def reclaim_space(max_pages=None):
+    """
+    Returns free pages to the file system, VACUUM_PAGES per step so writers can get in
+    between steps. No-op unless the database is in incremental auto_vacuum mode.
+    Returns the number of pages released.
+    """
+    conn = get_connection()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+    released = 0
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    while free and (max_pages is None or released < max_pages):
+        # executescript steps the pragma to completion; execute() frees a single page
+        conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES});")
+        left = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if left >= free:
+            break
+        released += free - left
+        free = left
+    return released
+
+
+def maintain(today=None):
+    """
+    Scheduled retention pass: archive, prune fingerprints and feed snapshots,
+    reclaim the freed pages.
+    """
+    moved = archive_articles(today)
+    pruned = prune_fingerprints(today)
+    dropped = snapshots.prune(today)
+    released = reclaim_space()
+    print(f"Retention: archived {moved} articles, pruned {pruned} fingerprints, dropped {dropped['snapshots']} "
+          f"snapshots ({dropped['mb']:.1f} MB), released {released} pages.")
+    return {"archived": moved, "fingerprints": pruned, "snapshots": dropped["snapshots"], "pages": released}
+
+
+# --- ARCHIVE-AWARE READS ---
+# Partitions keep no FTS index, so search text is matched against their headlines with LIKE
+
+def _open_partition(path):
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def _headline_filters(text):
+    """LIKE terms for the words and "phrases" of a search-box query (see database.build_fts_query)."""
+    where, params = [], []
+    for phrase, word in re.findall(r'"([^"]*)"|(\S+)', text):
+        term = (phrase or word).strip().rstrip("*").replace('"', "")
+        if re.search(r"\w", term):
+            where.append("articles.title LIKE ? ESCAPE '\\'")
+            params.append("%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    return where, params
+
+
+def query_all_articles(region=None, topic=None, firm=None, start=None, end=None, min_impact=None,
+                       order="impact", after=None, limit=50, summaries=False):
+    """
+    database.query_articles() over research.db and the archive partitions overlapping
+    [start, end], with the same keyset cursors. Each source is asked for its own next
+    `limit` rows, so memory is bounded by limit x partitions. summaries=True adds the
+    decompressed Summary column. Returns (DataFrame, next cursor or None).
+    """
+    keys = list(ARTICLE_ORDERS[order])
+    where, params = article_filters(region, topic, firm, start, end, min_impact)
+    if after is not None:
+        where.append(f"({', '.join(keys)}) < ({', '.join('?' * len(keys))})")
+        params.extend(after)
+    columns = f"{DASHBOARD_COLUMNS}, {', '.join('articles.' + k for k in keys)}"
+    if summaries:
+        columns += ", articles.summary AS Summary"
+    sql = f"SELECT {columns} FROM articles"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY " + ", ".join(f"{k} DESC" for k in keys) + " LIMIT ?"
+
+    frames = [pd.read_sql_query(sql, get_connection(), params=params + [limit])]
+    for _, path in _partitions(start, end):
+        part = _open_partition(path)
+        try:
+            frame = pd.read_sql_query(sql, part, params=params + [limit])
+        finally:
+            part.close()
+        if summaries:
+            frame["Summary"] = frame["Summary"].map(_inflate)
+        frames.append(frame)
+
+    df = pd.concat(frames, ignore_index=True).drop_duplicates("link_key")  # the live copy wins
+    df = df.sort_values(keys, ascending=False).head(limit)
+    # to_dict() gives plain Python values, which sqlite3 can bind on the next call
+    next_cursor = tuple(df[keys].iloc[-1].to_dict().values()) if len(df) == limit else None
+    df = df.drop(columns=keys).reset_index(drop=True)
+    if not df.empty:
+        df["Date"] = pd.to_datetime(df["Date"], errors="coerce").dt.date
+    return df, next_cursor
+
+
+def search_all_articles(text, region=None, topic=None, limit=50):
+    """
+    database.search_articles() followed by headline matches from the archive
+    partitions (highest impact first), up to `limit` rows in all.
+    """
+    live = database.search_articles(text, region, topic, limit)
+    terms, term_params = _headline_filters(text)
+    if not terms or len(live) >= limit:
+        return live
+    where, params = article_filters(region, topic)
+    sql = f"SELECT {DASHBOARD_COLUMNS}, articles.impact_score, articles.published_date FROM articles"
+    sql += " WHERE " + " AND ".join(where + terms)
+    sql += " ORDER BY impact_score DESC, published_date DESC LIMIT ?"
+    frames = []
+    for _, path in _partitions():
+        part = _open_partition(path)
+        try:
+            frames.append(pd.read_sql_query(sql, part, params=params + term_params + [limit]))
+        finally:
+            part.close()
+    if not frames:
+        return live
+    archived = pd.concat(frames, ignore_index=True)
+    archived = archived.sort_values(["impact_score", "published_date"], ascending=False)
+    archived = archived.drop(columns=["impact_score", "published_date"]).head(limit - len(live))
+    archived["Date"] = pd.to_datetime(archived["Date"], errors="coerce").dt.date
+    return pd.concat([live, archived], ignore_index=True).drop_duplicates("Link")
+
+
+def iter_all_articles(region=None, topic=None, text=None, chunk_size=5000):
+    """
+    database.iter_articles() followed by the matching rows of each archive partition,
+    newest month first, in the same (column names, rows) chunks.
+    """
+    yield from database.iter_articles(region, topic, text, chunk_size)
+    where, params = article_filters(region, topic)
+    if text:
+        terms, term_params = _headline_filters(text)
+        if not terms:
+            return
+        where, params = where + terms, params + term_params
+    sql = f"SELECT {DASHBOARD_COLUMNS} FROM articles"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY " + ", ".join(f"{k} DESC" for k in ARTICLE_ORDERS["impact"])
+    for _, path in _partitions():
+        part = _open_partition(path)
+        try:
+            cursor = part.execute(sql, params)
+            names = [d[0] for d in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield names, rows
+        finally:
+            part.close()
+
+
+def get_storage_stats():
+    conn = get_connection()
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    partitions = _partitions()
+    return {
+        "articles": conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0],
+        "archived": conn.execute("SELECT COUNT(*) FROM archived_keys").fetchone()[0],
+        "partitions": len(partitions),
+        "db_mb": conn.execute("PRAGMA page_count").fetchone()[0] * page_size / 1e6,
+        "free_mb": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size / 1e6,
+        "archive_mb": sum(os.path.getsize(path) for _, path in partitions) / 1e6,
+        "auto_vacuum": ["none", "full", "incremental"][conn.execute("PRAGMA auto_vacuum").fetchone()[0]],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old articles and reclaim space in research.db.")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="Convert the database to auto_vacuum=INCREMENTAL first (full VACUUM; stop other writers)")
+    parser.add_argument("--stats", action="store_true", help="Only print storage statistics")
+    args = parser.parse_args()
+
+    database.init_db()
+    if args.enable_incremental_vacuum and enable_incremental_vacuum():
+        print("Converted to incremental auto_vacuum.")
+    if not args.stats:
+        maintain()
+    for name, value in get_storage_stats().items():
+        print(f"{name}: {value:.1f}" if isinstance(value, float) else f"{name}: {value}")
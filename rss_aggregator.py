@@ -1,67 +1,31 @@
 import os
-import feedparser
+import argparse
+import random
+import socket
+from functools import partial
 import pandas as pd
-import sqlite3
 import datetime
-import re
 import time
 import urllib.parse
+import database
+import dedup
+import fetcher
+import alerts
+from engine import ImpactScorer, MAX_ENTRIES, rank_entries, rank_body, is_usable, to_article
+from fetcher import fetch_one, fetch_cached, cache_entries, DEFAULT_WORKERS, PARSE_WORKERS
+import snapshots
+import metrics
+import retention
 
 # Configuration
-DB_PATH = 'research.db'
+DB_PATH = database.DB_PATH
 SOURCES_PATH = 'sources.csv'
-
-class ImpactScorer:
-    """
-    Zero-cost heuristic engine to rate the 'Strategic Impact' of a headline.
-    Rates from 0 to 100 based on keywords and patterns.
-    """
-    
-    HIGH_VALUE_PATTERNS = [
-        r"report", r"outlook", r"forecast", r"trends?", r"202\d", r"future of", 
-        r"state of", r"comprehensive", r"strategic", r"global economy", 
-        r"white ?paper", r"survey", r"index", r"roadmap", r"playbook",
-        r"implications", r"deep dive", r"research", r"study", r"shift"
-    ]
-    
-    NOISE_PATTERNS = [
-        r"webinar", r"podcast", r"join us", r"register", r"hiring", r"career", 
-        r"award", r"appointed", r"partner", r"quarterly results", r"earnings", 
-        r"dividend", r"stock", r"shareholder", r"meet our", r"congratulations"
-    ]
-
-    def score(self, title, description):
-        text = (title + " " + description).lower()
-        score = 50 # Base score
-        
-        # Check high value indicators
-        for pattern in self.HIGH_VALUE_PATTERNS:
-            if re.search(pattern, text):
-                score += 15
-                
-        # Check noise indicators
-        for pattern in self.NOISE_PATTERNS:
-            if re.search(pattern, text):
-                score -= 50
-                
-        return max(0, min(100, score))
+# Entries go through engine's filters (blocklist, NOISE_FLOOR) and ImpactScorer, so rows
+# written here and by engine.ingest() share one score scale on the Dashboard
 
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS articles (
-            url TEXT PRIMARY KEY,
-            title TEXT,
-            firm TEXT,
-            published_date DATE,
-            summary TEXT,
-            impact_score INTEGER,
-            region TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    # The articles schema lives with the rest of the schema in database.py
+    database.init_db()
 
 def get_rss_url(strategy, query):
     """
@@ -76,46 +40,96 @@ def get_rss_url(strategy, query):
     # Fallback or direct link
     return query
 
+def extract_articles(feed, source_row, scorer, seen=()):
+    """
+    Article records for the usable entries of a parsed feed (engine.rank_entries()).
+    Entries whose link or GUID is in `seen` are skipped before any scoring.
+    """
+    return [to_article(row) for row in rank_entries(feed, source_row, scorer, seen)]
+
 def fetch_feed(source_row, scorer):
     url = get_rss_url(source_row['strategy'], source_row['query'])
     print(f"Fetching {source_row['name']} via {source_row['strategy']}...")
     
+    result = fetch_one(url, max_entries=MAX_ENTRIES, accept=lambda entry: is_usable(entry, scorer))
+    if result['error']:
+        print(f"Error fetching {source_row['name']}: {result['error']}")
+        return []
     try:
-        feed = feedparser.parse(url)
-        articles = []
-        
-        for entry in feed.entries[:10]: # Top 10 only
-            title = entry.get('title', 'No Title')
-            link = entry.get('link', '')
-            summary = entry.get('summary', '').replace('<b>', '').replace('</b>', '').replace('...','').strip()
-            # Clean up Google's " - SourceName" suffix
-            title = title.rsplit(' - ', 1)[0]
-            
-            # Date handling
-            published = entry.get('published_parsed', entry.get('updated_parsed'))
-            if published:
-                pub_date = datetime.datetime.fromtimestamp(time.mktime(published)).date()
-            else:
-                pub_date = datetime.date.today()
-
-            score = scorer.score(title, summary)
-            
-            articles.append({
-                'url': link,
-                'title': title,
-                'firm': source_row['name'],
-                'published_date': pub_date,
-                'summary': summary,
-                'impact_score': score,
-                'region': source_row['region']
-            })
-            
-        return articles
+        return extract_articles(result['feed'], source_row, scorer)
     except Exception as e:
         print(f"Error fetching {source_row['name']}: {e}")
         return []
 
-def run_aggregator():
+def extract_body(scorer, source, body):
+    """Parse-pool task: raw feed body of `source` -> (article records, entries parsed)."""
+    rows, entries = rank_body(scorer, source, body)
+    return [to_article(row) for row in rows], entries
+
+@metrics.track("aggregator")
+def sync_rows(rows, scorer, workers=DEFAULT_WORKERS, replay=False, since=None, until=None, parse_workers=PARSE_WORKERS):
+    """
+    Fetches the given source rows and stores their new articles.
+    Returns the per-source fetch results (in `rows` order) and the upsert counts.
+    With `replay` the feeds are read from the snapshots taken between since and until
+    instead, and every entry is rescored and re-tagged, not just the new ones.
+    parse_workers > 1 parses and scores on that many processes.
+    """
+    urls = [get_rss_url(row['strategy'], row['query']) for row in rows]
+    
+    def process(i, feed):
+        entries = feed.entries
+        with metrics.stage("db"):
+            seen = database.get_seen_keys([e.get('link') for e in entries] + [e.get('id') for e in entries])
+        return extract_articles(feed, rows[i], scorer, seen)
+    
+    all_articles = []
+    unchanged = 0
+    with metrics.stage("fetch"):
+        if replay:
+            results = snapshots.replay(urls, lambda i, feed: extract_articles(feed, rows[i], scorer), since, until, MAX_ENTRIES,
+                                       lambda entry: is_usable(entry, scorer))
+            print(f"Replaying {len(results)} snapshots.")
+        else:
+            results = fetch_cached(urls, process, "aggregator", workers=workers, max_entries=MAX_ENTRIES,
+                                   accept=lambda entry: is_usable(entry, scorer), task=partial(extract_body, scorer),
+                                   task_args=[dict(row) for row in rows], parse_workers=parse_workers, save_cache=False)
+    metrics.current().record_fetches([rows[r.get('i', i)]['name'] for i, r in enumerate(results)], results)
+    for i, result in enumerate(results):
+        row = rows[result.get('i', i)]  # replay results may repeat a source
+        if result.get('skipped'):
+            print(f"Skipping {row['name']}: {result['error']}")
+            continue
+        if result['error']:
+            print(f"Error fetching {row['name']}: {result['error']}")
+            continue
+        if result['status'] == 304:
+            # Already stored on the sync that first saw this version of the feed
+            unchanged += 1
+            continue
+        all_articles.extend(result['rows'])
+    print(f"{unchanged} sources unchanged since last sync.")
+    if not replay:
+        # Pool workers can't check the store, so seen entries are dropped here
+        with metrics.stage("db"):
+            seen = database.get_seen_keys([a['url'] for a in all_articles] + [a['guid'] for a in all_articles])
+        all_articles = [a for a in all_articles if a['url'] not in seen and a['guid'] not in seen]
+        
+    # Collapse syndicated copies (within the batch and against stored items)
+    with metrics.stage("dedup"):
+        kept, fingerprints = dedup.collapse_with_store(all_articles, 'title', 'summary', 'impact_score', 'url')
+    
+    # Save to DB: one bulk upsert and the feeds' new validators, one commit
+    with metrics.stage("db"):
+        counts = database.upsert_articles(kept, feed_cache=("aggregator", cache_entries(results)))
+        dedup.remember(fingerprints)
+    with metrics.stage("alerts"):
+        raised = alerts.check_articles(kept, counts['new_keys'])
+    print(f"Processed {len(all_articles)} items, {len(all_articles) - len(kept)} near-duplicates dropped. "
+          f"Inserted {counts['inserted']}, updated {counts['updated']}, skipped {counts['skipped']}. {raised} alerts raised.")
+    return results, counts
+
+def run_aggregator(workers=DEFAULT_WORKERS, replay=False, since=None, until=None, profile=None, parse_workers=PARSE_WORKERS):
     init_db()
     
     if not os.path.exists(SOURCES_PATH):
@@ -125,26 +139,191 @@ def run_aggregator():
     sources_df = pd.read_csv(SOURCES_PATH)
     scorer = ImpactScorer()
     
-    all_articles = []
-    for _, row in sources_df.iterrows():
-        all_articles.extend(fetch_feed(row, scorer))
+    rows = [row for _, row in sources_df.iterrows()]
+    if replay:
+        print(f"Reprocessing {len(rows)} sources from snapshots...")
+    else:
+        print(f"Fetching {len(rows)} sources with {workers} workers...")
+    with metrics.track("aggregator", profile=profile):
+        sync_rows(rows, scorer, workers, replay, since, until, parse_workers)
+    if profile:
+        print(f"Profile written to {profile}.prof and {profile}.txt")
+    print("Completed.")
+
+# --- DISTRIBUTED MODE ---
+LEASE_SECONDS = 300   # a claimed batch must finish within this, or other workers take it over
+CLAIM_BATCH = 8       # sources leased per claim
+MAX_ATTEMPTS = 3      # leases a source may lose before the round gives up on it
+IDLE_WAIT = 5.0       # seconds between checks while other workers hold the last leases
+
+def run_worker(workers=DEFAULT_WORKERS, shard=None, shards=1, round_id=None, batch=CLAIM_BATCH,
+               lease_seconds=LEASE_SECONDS, parse_workers=PARSE_WORKERS):
+    """
+    One of several aggregator processes sharing research.db. Every worker joins the
+    same round (sources.csv plus the sources table), claims batches of sources under a
+    lease, fetches and stores them, and marks them done. Sources of a worker that dies
+    are picked up by the others when its lease expires. Articles are upserted by link
+    key, so a batch fetched twice is stored once. Returns when the round is finished.
+    Host rate limits are per process, so a worker of shard K/N takes 1/N of each host's
+    budget; unsharded workers should set KB_RATE_SHARE to their number instead.
+    """
+    if shard is not None:
+        fetcher.HOST_RATE_SHARE = max(fetcher.HOST_RATE_SHARE, shards)
+    init_db()
+    if os.path.exists(SOURCES_PATH):
+        database.register_sources(pd.read_csv(SOURCES_PATH))
+    round_id = database.open_round(round_id)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    label = f"shard {shard}/{shards}" if shard is not None else "no shard"
+    print(f"Worker {worker} ({label}) joined round {round_id}.")
+    scorer = ImpactScorer()
+    fetched = 0
+    
+    while True:
+        claimed = database.claim_sources(round_id, worker, batch, lease_seconds, shard, shards, MAX_ATTEMPTS)
+        if claimed.empty:
+            status = database.get_round_status(round_id)
+            if status["open"] == 0:
+                break
+            # The rest is leased to other workers; wait in case one of them dies
+            time.sleep(IDLE_WAIT)
+            continue
+        rows = [row for _, row in claimed.iterrows()]
+        sync_rows(rows, scorer, workers, parse_workers=parse_workers)
+        done = database.complete_sources(round_id, worker, [int(row['id']) for row in rows])
+        if done < len(rows):
+            print(f"{len(rows) - done} leases expired before the batch finished; another worker owns them now.")
+        fetched += len(rows)
+    print(f"Round {round_id} finished. This worker fetched {fetched} sources.")
+    return fetched
+
+# --- ADAPTIVE SCHEDULER ---
+MIN_POLL_INTERVAL = 30 * 60          # never poll a source more than every 30 minutes
+MAX_POLL_INTERVAL = 24 * 60 * 60     # nor less than once a day
+DEFAULT_POLL_INTERVAL = 4 * 60 * 60  # until we have publication history
+POLL_JITTER = 0.1                    # +/- 10% so sources don't fall into lockstep
+POLL_BUDGET = 30                     # max polls per minute across all sources
+HISTORY_DAYS = 30
+
+def estimate_poll_interval(dates, today=None):
+    """
+    Polls about twice per expected publication: half the mean gap between
+    the source's recent articles, clamped to [MIN_POLL_INTERVAL, MAX_POLL_INTERVAL].
+    """
+    if not dates:
+        return DEFAULT_POLL_INTERVAL
+    today = today or datetime.date.today()
+    span_days = max(1, (today - min(dates)).days + 1)
+    mean_gap = span_days * 86400 / len(dates)
+    return max(MIN_POLL_INTERVAL, min(MAX_POLL_INTERVAL, mean_gap / 2))
+
+def run_scheduler(workers=DEFAULT_WORKERS, budget=POLL_BUDGET, max_cycles=None, parse_workers=PARSE_WORKERS):
+    """
+    Long-running mode: polls each source when it is due, at a rate learned from
+    how often it publishes. Schedule state lives in the sources table, so a
+    restart picks up where it left off. Retention (archive + space reclamation)
+    runs once per RETENTION_INTERVAL, starting with the first cycle.
+    """
+    init_db()
+    if os.path.exists(SOURCES_PATH):
+        database.register_sources(pd.read_csv(SOURCES_PATH))
+    scorer = ImpactScorer()
+    
+    # Token bucket holding up to one minute's worth of polls
+    tokens = float(budget)
+    refilled_at = time.monotonic()
+    cycles = 0
+    next_maintenance = time.time()
+    
+    while max_cycles is None or cycles < max_cycles:
+        cycles += 1
+        now = time.monotonic()
+        tokens = min(budget, tokens + (now - refilled_at) * budget / 60)
+        refilled_at = now
         
-    # Save to DB
-    conn = sqlite3.connect(DB_PATH)
-    count = 0
-    for a in all_articles:
-        try:
-            conn.execute('''
-                INSERT OR IGNORE INTO articles (url, title, firm, published_date, summary, impact_score, region)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (a['url'], a['title'], a['firm'], a['published_date'], a['summary'], a['impact_score'], a['region']))
-            count += 1
-        except sqlite3.Error as e:
-            pass
+        due = database.get_due_sources(time.time(), limit=int(tokens))
+        if not due.empty:
+            tokens -= len(due)
+            rows = [row for _, row in due.iterrows()]
+            print(f"Polling {len(rows)} due sources...")
+            sync_rows(rows, scorer, workers, parse_workers=parse_workers)
             
-    conn.commit()
-    conn.close()
-    print(f"Completed. Processed {len(all_articles)} items. Saved {count} to DB.")
+            history = database.get_publication_dates([row['name'] for row in rows], HISTORY_DAYS)
+            updates = []
+            for row in rows:
+                interval = estimate_poll_interval(history.get(row['name'], []))
+                jitter = random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+                updates.append((row['id'], interval, time.time() + interval * jitter))
+            database.update_schedule(updates)
+        
+        if time.time() >= next_maintenance:
+            retention.maintain()
+            next_maintenance = time.time() + retention.RETENTION_INTERVAL
+        
+        if max_cycles is not None and cycles >= max_cycles:
+            break
+        # Sleep until the next source is due, or until the budget refills one poll
+        next_poll = database.get_next_poll_time()
+        wait = 60.0 if next_poll is None else next_poll - time.time()
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) * 60 / budget)
+        time.sleep(min(60.0, max(1.0, wait)))
+
+def rescore_articles(scorer=None):
+    """
+    Recomputes impact_score and topic for every stored article from its title and
+    summary, e.g. after changing the scoring terms or TOPIC_MAP. No network access needed.
+    """
+    init_db()
+    scorer = scorer or ImpactScorer()
+    df = pd.read_sql_query("SELECT link_key, title, summary, impact_score, topic FROM articles", database.get_connection())
+    if df.empty:
+        print("No articles to rescore.")
+        return 0
+    
+    df['new_score'], df['new_topic'] = scorer.analyze_batch(df['title'], df['summary'])
+    changed = df[(df['new_score'] != df['impact_score']) | (df['new_topic'] != df['topic'])]
+    with database.transaction() as conn:
+        conn.executemany(
+            "UPDATE articles SET impact_score = ?, topic = ? WHERE link_key = ?",
+            zip(changed['new_score'].tolist(), changed['new_topic'].tolist(), changed['link_key'].tolist())
+        )
+    print(f"Rescored {len(df)} articles. {len(changed)} changed.")
+    return len(changed)
 
 if __name__ == "__main__":
-    run_aggregator()
+    parser = argparse.ArgumentParser(description="Fetch, score and store research feeds.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Concurrent fetch workers")
+    parser.add_argument("--rescore", action="store_true", help="Rescore stored articles instead of fetching")
+    parser.add_argument("--daemon", action="store_true", help="Keep running, polling each source on its own schedule")
+    parser.add_argument("--budget", type=int, default=POLL_BUDGET, help="Max polls per minute in daemon mode")
+    parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS,
+                        help="Processes for parsing and scoring (0 or 1 = in-process; default $KB_PARSE_WORKERS)")
+    parser.add_argument("--profile", metavar="PATH", help="Capture a cProfile/tracemalloc profile of this run to PATH.prof/.txt")
+    parser.add_argument("--metrics", action="store_true", help="Print the latest metrics in Prometheus text format and exit")
+    parser.add_argument("--replay", action="store_true", help="Reprocess stored feed snapshots instead of fetching (recorded when KB_SNAPSHOTS=1)")
+    parser.add_argument("--since", type=datetime.date.fromisoformat, help="Replay window start (YYYY-MM-DD, UTC)")
+    parser.add_argument("--until", type=datetime.date.fromisoformat, help="Replay window end, inclusive (YYYY-MM-DD, UTC)")
+    parser.add_argument("--distributed", action="store_true",
+                        help="Work through a round of sources together with other --distributed workers "
+                             "(without --shard, set KB_RATE_SHARE to the number of workers)")
+    parser.add_argument("--shard", metavar="K/N", help="Prefer sources in shard K of N (id %% N == K), then steal from the rest")
+    parser.add_argument("--round", dest="round_id", help="Name of the round to join (default: the open one, or a new one)")
+    parser.add_argument("--lease", type=float, default=LEASE_SECONDS, help="Seconds a claimed batch stays leased")
+    parser.add_argument("--batch", type=int, default=CLAIM_BATCH, help="Sources claimed at a time")
+    args = parser.parse_args()
+    
+    if args.metrics:
+        init_db()
+        print(metrics.prometheus_text(), end="")
+    elif args.rescore:
+        rescore_articles()
+    elif args.distributed:
+        shard, shards = (int(n) for n in args.shard.split("/")) if args.shard else (None, 1)
+        run_worker(workers=args.workers, shard=shard, shards=shards, round_id=args.round_id, batch=args.batch,
+                   lease_seconds=args.lease, parse_workers=args.parse_workers)
+    elif args.daemon:
+        run_scheduler(workers=args.workers, budget=args.budget, parse_workers=args.parse_workers)
+    else:
+        run_aggregator(workers=args.workers, replay=args.replay, since=args.since, until=args.until, profile=args.profile,
+                       parse_workers=args.parse_workers)
@@ -0,0 +1,132 @@
+import datetime
+import gzip
+import hashlib
+import os
+import time
+
+from database import DB_PATH, record_snapshots, get_snapshots, get_snapshot_digests, delete_snapshots
+from feedstream import parse_stream
+
+# --- CONFIGURATION ---
+# Raw feed bodies, gzipped and named by the SHA-256 of the uncompressed bytes:
+# snapshots/ab/abcdef....xml.gz. A body fetched twice is stored once.
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "snapshots")
+# Off by default: a snapshot needs the whole body, so fetches can't stop reading early
+SNAPSHOT_FEEDS = os.environ.get("KB_SNAPSHOTS", "0") == "1"
+COMPRESS_LEVEL = 6
+# retention.maintain() drops snapshots older than this, then the least recently fetched
+# bodies until the store fits SNAPSHOT_MAX_MB
+SNAPSHOT_RETENTION_DAYS = 30
+SNAPSHOT_MAX_MB = 500
+ORPHAN_GRACE = 60 * 60  # an unindexed file younger than this may still be getting recorded
+
+
+def _path(digest):
+    return os.path.join(SNAPSHOT_DIR, digest[:2], digest + ".xml.gz")
+
+
+def store(body):
+    """Writes a raw body to the store unless it's already there. Returns its digest."""
+    digest = hashlib.sha256(body).hexdigest()
+    path = _path(digest)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            # mtime=0 keeps the file a pure function of its content
+            f.write(gzip.compress(body, COMPRESS_LEVEL, mtime=0))
+        os.replace(tmp, path)
+    return digest
+
+
+def load(digest):
+    with open(_path(digest), "rb") as f:
+        return gzip.decompress(f.read())
+
+
+def snapshot_results(results):
+    """Stores and indexes the 'body' of each fetch result that has one."""
+    items = []
+    for result in results:
+        body = result.get("body")
+        if body:
+            items.append((result["url"], store(body), len(body)))
+    if items:
+        record_snapshots(items)
+
+
+def _files():
+    """(digest, path, size, mtime) of every stored body."""
+    found = []
+    for root, _, names in os.walk(SNAPSHOT_DIR):
+        for name in names:
+            if name.endswith(".xml.gz"):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                found.append((name[:-len(".xml.gz")], path, stat.st_size, stat.st_mtime))
+    return found
+
+
+def prune(today=None, max_age_days=SNAPSHOT_RETENTION_DAYS, max_mb=SNAPSHOT_MAX_MB):
+    """
+    Drops index rows older than max_age_days, then whole bodies, least recently fetched
+    first, until the store fits max_mb, then deletes files nothing refers to.
+    Returns {'snapshots': index rows removed, 'files': files removed, 'mb': MB freed}.
+    """
+    today = today or datetime.date.today()
+    removed = delete_snapshots(before=str(today - datetime.timedelta(days=max_age_days)))
+    sizes = {digest: size for digest, _, size, _ in _files()}
+    total = sum(sizes.values())
+    evict = []
+    for digest, _ in get_snapshot_digests():
+        if total <= max_mb * 1e6:
+            break
+        evict.append(digest)
+        total -= sizes.get(digest, 0)
+    if evict:
+        removed += delete_snapshots(digests=evict)
+
+    referenced = {digest for digest, _ in get_snapshot_digests()}
+    files, freed = 0, 0
+    for digest, path, size, mtime in _files():
+        if digest not in referenced and time.time() - mtime > ORPHAN_GRACE:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            files += 1
+            freed += size
+    return {"snapshots": removed, "files": files, "mb": freed / 1e6}
+
+
+def _bound(value, end=False):
+    """Dates mean whole days: `until` is inclusive of its day."""
+    if isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return value + datetime.timedelta(days=1) if end else value
+    return value
+
+
+def replay(urls, process, since=None, until=None, max_entries=None, accept=None):
+    """
+    Offline counterpart of fetcher.fetch_cached(): reprocesses the stored snapshots of
+    `urls` taken between since and until (dates or datetimes, UTC) without touching the
+    network. Returns one result per distinct snapshot, oldest first, each carrying the
+    index `i` of its url and 'rows' = process(i, feed). Identical bodies of a url are
+    processed once.
+    """
+    urls = list(urls)
+    positions = {url: i for i, url in enumerate(urls)}
+    results, done = [], set()
+    for url, digest, fetched_at in get_snapshots(urls, _bound(since), _bound(until, end=True)):
+        if (url, digest) in done:
+            continue
+        done.add((url, digest))
+        result = {"url": url, "i": positions[url], "status": 200, "feed": None, "error": None,
+                  "fetched_at": fetched_at, "rows": []}
+        try:
+            result["feed"] = parse_stream([load(digest)], max_entries, accept)
+            result["rows"] = process(result["i"], result["feed"])
+        except Exception as e:
+            result["error"] = str(e)
+        results.append(result)
+    return results
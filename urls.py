@@ -0,0 +1,50 @@
+import hashlib
+import urllib.parse
+
+# Query parameters that only track the click or pick a UI locale, never the content
+TRACKING_PARAMS = {
+    "hl", "gl", "ceid", "oc",                   # Google News locale / redirect markers
+    "fbclid", "gclid", "msclkid", "mc_cid", "mc_eid", "igshid",
+    "ref", "ref_src", "cmpid", "icid", "cid", "sr_share", "form",
+}
+TRACKING_PREFIXES = ("utm_", "hsa_", "_hs")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonicalize(url):
+    """
+    Normalizes a link so that trivially different URLs for the same page compare equal.
+    The host is lowercased and www. and default ports are dropped. http and https are
+    treated alike. Tracking parameters and the fragment are removed, the remaining
+    query is sorted and trailing slashes are trimmed. Non-http(s) input is returned stripped.
+    """
+    url = (url or "").strip()
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS:
+        return url
+
+    host = (parts.hostname or "").rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port and parts.port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{parts.port}"
+
+    path = urllib.parse.quote(urllib.parse.unquote(parts.path), safe="/:@!$&'()*+,;=-._~%") or "/"
+    if len(path) > 1:
+        path = path.rstrip("/")
+
+    query = sorted(
+        (k, v) for k, v in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIXES)
+    )
+    return urllib.parse.urlunsplit(("https", host, path, urllib.parse.urlencode(query), ""))
+
+
+def link_key(url):
+    """
+    Fixed-width key of the canonical URL: a signed 64-bit int, so it fits an SQLite
+    INTEGER column and makes for compact indexes and fast set membership.
+    """
+    digest = hashlib.blake2b(canonicalize(url).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)